@@ -1,33 +1,72 @@
+import json
 import time
 from measures import ObjectiveMeasures, SubjectiveMeasures, ExpertEvaluation
+from async_runner import run_sync
+from evaluator import aensure_analysis
+from telemetry import track_run
+from prompt_history import PromptHistory
 
 class AdHocSimulator:
     """
     Ad hoc approach. We incorporate measure-tracking here.
+    stream=True streams generations and aborts those running past the task's max
+    word count by more than abort_margin (see Participant.agenerate_output).
     """
 
-    def __init__(self, evaluator, max_iterations=5, score_threshold=85, expert_evaluator=None):
+    def __init__(self, evaluator, max_iterations=5, score_threshold=85, expert_evaluator=None,
+                 stream=False, abort_margin=0.2, history_blocks=None, prompt_token_budget=None,
+                 prompt_layout="single"):
         self.evaluator = evaluator
+        self.stream = stream
+        self.abort_margin = abort_margin
+        # Feedback kept verbatim / total prompt budget (see PromptHistory; None = unbounded)
+        self.history_blocks = history_blocks
+        self.prompt_token_budget = prompt_token_budget
+        # "conversation" = stable persona/task-spec prefix + feedback as follow-up turns
+        self.prompt_layout = prompt_layout
         self.max_iterations = max_iterations
         self.score_threshold = score_threshold
         # Optional domain expert evaluator (e.g., GPT-4o in expert mode or real human)
         self.expert_evaluator = expert_evaluator
 
-    def  simulate(self, participant, task):
+    def simulate(self, participant, task):
+        return run_sync(self.asimulate(participant, task))
+
+    async def asimulate(self, participant, task):
+        # Call-layer events (circuit trips/recoveries, reroutes, queue wait) are attributed to this run
+        with track_run() as telemetry:
+            result = await self._arun(participant, task)
+        return telemetry.merge_into(result)
+
+    async def _arun(self, participant, task):
         start_time = time.time()
         iteration_count = 0
         final_output = ""
         final_score = 0
 
-        current_prompt = (
-            f"Your task:\n{task.target_spec}\n\n"
-            "Please produce your best final output."
+        history = PromptHistory(
+            (
+                f"Your task:\n{task.target_spec}\n\n"
+                "Please produce your best final output."
+            ),
+            header="[AD HOC FEEDBACK] Please refine the output based on:",
+            footer="Try again and improve your answer.",
+            keep_last=self.history_blocks,
+            token_budget=self.prompt_token_budget,
+            layout=self.prompt_layout,
         )
+        current_prompt = history.prompt()
+        prompt_tokens = []
 
         for _ in range(self.max_iterations):
             iteration_count += 1
-            output_text = participant.generate_output(user_instruction=current_prompt)
-            eval_results = self.evaluator.evaluate_output(output_text, task.rubric)
+            prompt_tokens.append(history.tokens())
+            output_text = await participant.agenerate_output(
+                user_instruction=current_prompt,
+                stream=self.stream, rubric=task.rubric, abort_margin=self.abort_margin,
+                budget_key=task.name
+            )
+            eval_results = await self.evaluator.aevaluate_output(output_text, task.compiled_rubric)
             score = eval_results["score"]
 
             final_output = output_text
@@ -36,12 +75,11 @@ class AdHocSimulator:
             if score >= self.score_threshold:
                 break
 
+            # Only now is the (lazy) GPT-4o analysis needed
+            await aensure_analysis(eval_results)
             feedback_summary = self._extract_feedback(eval_results)
-            current_prompt += (
-                "\n\n[AD HOC FEEDBACK] Please refine the output based on:\n"
-                f"{feedback_summary}\n"
-                "Try again and improve your answer."
-            )
+            history.add(feedback_summary)
+            current_prompt = history.prompt()
 
         end_time = time.time()
         total_time_sec = end_time - start_time
@@ -59,7 +97,7 @@ class AdHocSimulator:
         expert_eval_data = None
         if self.expert_evaluator is not None:
             domain = "technical"  # or "educational", "business", etc.
-            expert_dict = self.expert_evaluator.evaluate_as_expert(final_output, domain)
+            expert_dict = await self.expert_evaluator.aevaluate_as_expert(final_output, domain, budget_key=task.name)
             expert_eval_data = ExpertEvaluation(
                 correctness_score=expert_dict["correctness_score"],
                 style_score=expert_dict["style_score"],
@@ -86,6 +124,8 @@ class AdHocSimulator:
 
         # Optionally include the final output text
         result["final_output"] = final_output
+        # Estimated tokens of the refinement prompt sent in each iteration
+        result["prompt_tokens_per_iter"] = json.dumps(prompt_tokens)
 
         return result
 
@@ -94,7 +134,15 @@ class AdHocSimulator:
         if not eval_results["word_count_ok"]:
             lines.append("Word count is out of the specified range.")
         if not eval_results["must_include_ok"]:
-            lines.append("You missed one or more required keywords or phrases.")
+            missing = eval_results.get("missing_keywords")
+            if missing:
+                lines.append("You missed these required keywords or phrases: " + ", ".join(missing))
+            else:
+                lines.append("You missed one or more required keywords or phrases.")
+        failed = (eval_results.get("check_failures")
+                  or [name for name, ok in eval_results.get("checks", {}).items() if not ok])
+        if failed:
+            lines.append("Failed format checks: " + "; ".join(failed))
         analysis_text = eval_results.get("analysis", "")
         truncated_analysis = analysis_text[:300] + "..." if len(analysis_text) > 300 else analysis_text
         lines.append(f"Analysis says: {truncated_analysis}")
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Optional
+
+# A single long-lived event loop (on a daemon thread) backs every synchronous
+# wrapper, so sync callers -- including worker threads -- share one loop and
+# whatever per-loop state (sessions, limiters) hangs off it.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _shared_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="pdr-asyncio", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+def run_sync(coro: Awaitable[Any]) -> Any:
+    """
+    Runs a coroutine to completion on the shared background loop and returns its result.
+    Used by the sync API (generate_output, simulate, ...) as a thin wrapper over the async one.
+    Must not be called from a coroutine already running on the shared loop (it would deadlock);
+    await the async method instead.
+    """
+    loop = _shared_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        if hasattr(coro, "close"):
+            coro.close()
+        raise RuntimeError(
+            "Synchronous wrapper called from inside the shared event loop; "
+            "await the async counterpart instead."
+        )
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
@@ -0,0 +1,200 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+
+_SNAPSHOT = re.compile(r"-\d{4}-\d{2}-\d{2}$")  # dated snapshot suffix, e.g. gpt-4o-2024-08-06
+
+
+def answering_model(resp, requested: str) -> str:
+    """
+    The model that produced `resp`: `requested` unless the response names another one
+    (e.g. a circuit-breaker fallback), with the dated snapshot suffix stripped so
+    observations land on the alias the callers use.
+    """
+    model = (resp or {}).get("model")
+    if not model:
+        return requested
+    base = _SNAPSHOT.sub("", model)
+    return requested if base == _SNAPSHOT.sub("", requested) else base
+
+
+def completion_tokens(resp) -> Optional[int]:
+    """Completion tokens billed for a response (reasoning tokens included)."""
+    usage = (resp or {}).get("usage") or {}
+    return usage.get("completion_tokens")
+
+
+class BudgetLearner:
+    """
+    Learns first-attempt max_tokens budgets per (model, budget_key) from what replies
+    actually used, instead of a fixed default followed by a hard-coded bigger retry.
+
+    - suggest() returns the (1 - target_retry_rate) quantile of observed need times
+      `headroom`, so roughly target_retry_rate of first attempts still get truncated
+    - record() counts every first attempt and whether it was truncated (finish_reason
+      "length" / empty reply); untruncated replies add their completion tokens as a need
+      sample. record_need() adds the need revealed by a successful retry.
+    - retry_rate() / stats() report the truncation-retry rate actually achieved.
+
+    Samples are kept in a sliding window per key and persisted as JSON at `path`
+    (rewritten atomically every `save_every` records and on save()).
+    """
+
+    def __init__(self, path: Optional[str] = "cache/token_budgets.json", target_retry_rate: float = 0.05,
+                 headroom: float = 1.15, min_samples: int = 8, window: int = 200,
+                 min_budget: int = 64, max_budget: int = 16000, save_every: int = 20):
+        self.path = path
+        self.target_retry_rate = target_retry_rate
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.window = window
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.save_every = save_every
+        self._samples: Dict[str, deque] = {}
+        self._attempts: Dict[str, int] = {}
+        self._truncations: Dict[str, int] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(model: str, budget_key: str) -> str:
+        return f"{model}|{budget_key}"
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return  # unreadable state file: start learning from scratch
+        for key, entry in data.items():
+            self._samples[key] = deque(entry.get("samples", []), maxlen=self.window)
+            self._attempts[key] = entry.get("attempts", 0)
+            self._truncations[key] = entry.get("truncations", 0)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                key: {
+                    "samples": list(samples),
+                    "attempts": self._attempts.get(key, 0),
+                    "truncations": self._truncations.get(key, 0),
+                }
+                for key, samples in ((k, self._samples.get(k, ())) for k in set(self._samples) | set(self._attempts))
+            }
+            self._unsaved = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def suggest(self, model: str, budget_key: str, default: int) -> int:
+        with self._lock:
+            samples = sorted(self._samples.get(self._key(model, budget_key)) or ())
+        if len(samples) < self.min_samples:
+            return default
+        idx = min(len(samples) - 1, int(math.ceil((1.0 - self.target_retry_rate) * len(samples))) - 1)
+        budget = int(math.ceil(samples[max(0, idx)] * self.headroom))
+        return max(self.min_budget, min(self.max_budget, budget))
+
+    def _add_sample_locked(self, key: str, tokens: int):
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(int(tokens))
+
+    def record(self, model: str, budget_key: str, budget: int, used_tokens: Optional[int], truncated: bool):
+        """
+        One first attempt made with `budget`. A truncated attempt only says the need
+        exceeded the budget, so it is not added as a sample (see record_need).
+        """
+        key = self._key(model, budget_key)
+        with self._lock:
+            self._attempts[key] = self._attempts.get(key, 0) + 1
+            if truncated:
+                self._truncations[key] = self._truncations.get(key, 0) + 1
+            elif used_tokens:
+                self._add_sample_locked(key, used_tokens)
+            self._unsaved += 1
+            save = self._unsaved >= self.save_every
+        if save:
+            self.save()
+
+    def record_need(self, model: str, budget_key: str, used_tokens: Optional[int]):
+        if used_tokens:
+            with self._lock:
+                self._add_sample_locked(self._key(model, budget_key), used_tokens)
+
+    def retry_rate(self, model: Optional[str] = None, budget_key: Optional[str] = None) -> float:
+        """
+        Achieved truncation-retry rate, overall or for one model / budget_key.
+        """
+        with self._lock:
+            keys = [k for k in self._attempts
+                    if (model is None or k.split("|", 1)[0] == model)
+                    and (budget_key is None or k.split("|", 1)[1] == budget_key)]
+            attempts = sum(self._attempts[k] for k in keys)
+            truncations = sum(self._truncations.get(k, 0) for k in keys)
+        return truncations / attempts if attempts else 0.0
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            keys = list(self._attempts)
+        out = {}
+        for key in keys:
+            model, budget_key = key.split("|", 1)
+            attempts = self._attempts.get(key, 0)
+            out[key] = {
+                "attempts": attempts,
+                "truncations": self._truncations.get(key, 0),
+                "retry_rate": self._truncations.get(key, 0) / attempts if attempts else 0.0,
+                "samples": len(self._samples.get(key) or ()),
+                "budget": self.suggest(model, budget_key, default=0) or None,
+            }
+        return out
+
+
+# ---- Process-wide learner used by Participant / LLMCritic / ExpertEvaluator (None = fixed budgets)
+_learner: Optional[BudgetLearner] = None
+
+
+def configure_budget_learner(enabled: bool = True, **kwargs) -> Optional[BudgetLearner]:
+    """
+    Enables learned first-attempt budgets; kwargs (path, target_retry_rate, headroom, ...)
+    go to BudgetLearner.
+    """
+    global _learner
+    if _learner is not None:
+        _learner.save()
+    _learner = BudgetLearner(**kwargs) if enabled else None
+    return _learner
+
+
+def get_budget_learner() -> Optional[BudgetLearner]:
+    return _learner
+
+
+def first_attempt_budget(model: str, budget_key: Optional[str], default: int) -> int:
+    """
+    max_tokens for a first attempt: learned when a learner is configured and the
+    caller passed a budget_key, else the caller's default.
+    """
+    if _learner is None or budget_key is None:
+        return default
+    return _learner.suggest(model, budget_key, default)
+
+
+def budget_stats() -> Optional[dict]:
+    if _learner is None:
+        return None
+    return {"retry_rate": _learner.retry_rate(), "per_key": _learner.stats()}
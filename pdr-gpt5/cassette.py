@@ -0,0 +1,108 @@
+import gzip
+import json
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class CassetteMiss(RuntimeError):
+    """
+    Raised in replay mode when a request has no (remaining) recorded response.
+    """
+
+
+class Cassette:
+    """
+    Record/replay of chat-completion request/response pairs.
+
+    mode="record": every response returned by the call layer is appended to a
+    gzip'd JSON-lines file (one line per call: request key, model, latency, response).
+    mode="replay": responses are served back from the file without touching the
+    network. Requests are matched on their content key (same hash as the response
+    cache); repeated identical requests are served in recorded order.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", replay_latency: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.recorded = 0
+        self.played = 0
+        self._lock = threading.Lock()
+        self._tapes = defaultdict(deque)
+        self._fh = None
+
+        if mode == "record":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._fh = gzip.open(path, "at", encoding="utf-8")
+        else:
+            with gzip.open(path, "rt", encoding="utf-8") as fh:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._tapes[entry["key"]].append(entry)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(self, key: str, model: str, response, latency_sec: float = 0.0):
+        line = json.dumps(
+            {"key": key, "model": model, "latency_sec": round(latency_sec, 4), "response": response},
+            ensure_ascii=False, separators=(",", ":"), default=str,
+        )
+        with self._lock:
+            self._fh.write(line + "\n")
+            self.recorded += 1
+
+    def play(self, key: str, model: str = "") -> Tuple[dict, float]:
+        """
+        Returns (response, latency to simulate). latency is 0 unless replay_latency=True.
+        """
+        with self._lock:
+            tape = self._tapes.get(key)
+            if not tape:
+                raise CassetteMiss(f"No recorded response left for {model or 'request'} (key {key[:12]}...) in {self.path}")
+            entry = tape.popleft()
+            self.played += 1
+        return entry["response"], (entry.get("latency_sec", 0.0) if self.replay_latency else 0.0)
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def __enter__(self):
+        set_cassette(self)
+        return self
+
+    def __exit__(self, *exc):
+        set_cassette(None)
+        self.close()
+
+
+# ---- Process-wide cassette used by retry_helpers (None = live calls)
+_cassette: Optional[Cassette] = None
+
+
+def set_cassette(cassette: Optional[Cassette]):
+    global _cassette
+    _cassette = cassette
+
+
+def get_cassette() -> Optional[Cassette]:
+    return _cassette
+
+
+def use_cassette(path: str, mode: str = "replay", replay_latency: bool = False) -> Cassette:
+    """
+    Opens a cassette and makes it the active one; use as `with use_cassette(...):`
+    or call .close() / set_cassette(None) when done.
+    """
+    cassette = Cassette(path, mode=mode, replay_latency=replay_latency)
+    set_cassette(cassette)
+    return cassette
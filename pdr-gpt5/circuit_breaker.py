@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from telemetry import current_run
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a model whose circuit is open; callers with
+    fallback models route to the next one immediately.
+    """
+
+    def __init__(self, model: str):
+        super().__init__(f"Circuit open for {model}; call short-circuited")
+        self.model = model
+
+
+class CircuitBreaker:
+    """
+    Per-model circuit breaker shared by every client in the process.
+
+    closed    -> calls pass; `failure_threshold` consecutive retryable failures (429/5xx/network) trip it
+    open      -> calls are rejected for `recovery_sec`
+    half_open -> up to `half_open_probes` calls probe the model; a success closes the
+                 circuit, a failure re-opens it for another recovery period. A probe that
+                 ends without either (cancelled, non-retryable error) must call
+                 release_probe() so its slot goes to the next caller.
+    """
+
+    def __init__(self, model: str, failure_threshold: int = 5, recovery_sec: float = 30.0,
+                 half_open_probes: int = 1):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.recovery_sec = recovery_sec
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_sec:
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self._probes = 0
+        if recovered:
+            self._emit("recovered")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                event = "reopened"
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                event = "tripped"
+                self.trips += 1
+            else:
+                return
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probes = 0
+        self._emit(event)
+
+    def release_probe(self):
+        """Frees a half-open probe slot whose call ended without an outcome."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def _emit(self, event: str):
+        run = current_run()
+        if run is not None:
+            run.add_circuit_event(self.model, event)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_defaults: Optional[dict] = None  # None = breakers off until configured
+_registry_lock = threading.Lock()
+
+
+def configure_circuit_breakers(enabled: bool = True, **kwargs):
+    """
+    Turns circuit breaking on (it is off by default) with the given parameters
+    (failure_threshold, recovery_sec, half_open_probes) for all models, resetting their
+    state; enabled=False turns it off again.
+    """
+    global _defaults
+    with _registry_lock:
+        _defaults = dict(kwargs) if enabled else None
+        _breakers.clear()
+
+
+def get_breaker(model: str) -> Optional[CircuitBreaker]:
+    if _defaults is None or not model:
+        return None
+    with _registry_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(model, **(_defaults or {}))
+        return breaker
+
+
+def breaker_stats() -> Dict[str, dict]:
+    return {model: b.stats() for model, b in list(_breakers.items())}
@@ -0,0 +1,118 @@
+import ast
+import re
+from typing import Iterable, List, Optional
+
+_FENCE = re.compile(r"^[ \t]*```[ \t]*([\w+-]*)[^\n]*\n(.*?)^[ \t]*```", re.MULTILINE | re.DOTALL)
+
+# A subject line, optionally behind a list marker, markdown '#'s and `...` / **...** wrappers
+_COMMIT_SUBJECT = re.compile(
+    r"^[ \t]*(?:[-*][ \t]+|\d+[.)][ \t]+)?(?:#+[ \t]*)?(?:\*\*|`)?"
+    r"(?P<type>feat|fix|docs|refactor|test|chore|build|ci|perf|style|revert)"
+    r"(?P<scope>\([^)\s]+\))?!?:[ \t]+(?P<subject>\S.*?)(?:\*\*|`)?[ \t]*$",
+    re.MULTILINE,
+)
+
+_RAISES_CALLS = {"raises", "assertRaises", "assertRaisesRegex"}
+
+
+def extract_code_blocks(text: str, languages: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Bodies of the fenced (```) code blocks in `text`, optionally only those whose
+    language tag is in `languages` (case-insensitive).
+    """
+    wanted = {lang.lower() for lang in languages} if languages is not None else None
+    return [
+        body for tag, body in _FENCE.findall(text)
+        if wanted is None or tag.lower() in wanted
+    ]
+
+
+def analyze_python(code: str) -> dict:
+    """
+    Static facts about a Python module: whether it parses, and how many assertions
+    (assert statements and self.assert* calls), test functions (test_*) and
+    exception checks (pytest.raises / assertRaises) it contains.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return {"syntax_ok": False, "syntax_error": f"line {e.lineno}: {e.msg}",
+                "asserts": 0, "tests": 0, "raises": 0}
+    asserts = tests = raises = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assert):
+            asserts += 1
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+            tests += 1
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", "")
+            if name in _RAISES_CALLS:
+                raises += 1
+            elif isinstance(func, ast.Attribute) and name.startswith("assert"):
+                asserts += 1
+    return {"syntax_ok": True, "asserts": asserts, "tests": tests, "raises": raises}
+
+
+def check_python_code(text: str, blocks: Optional[int] = 1, min_asserts: int = 0, min_tests: int = 0,
+                      min_raises: int = 0, languages: Iterable[str] = ("python", "py")) -> dict:
+    """
+    Checks the ```python blocks of an answer: the block count (None = at least one),
+    that they parse, and minimum numbers of asserts, test functions and exception checks.
+    Returns the facts plus "ok" and a list of human-readable "failures".
+    """
+    found = extract_code_blocks(text, languages)
+    facts = analyze_python("\n\n".join(found)) if found else {
+        "syntax_ok": False, "asserts": 0, "tests": 0, "raises": 0}
+    facts["blocks"] = len(found)
+
+    failures = []
+    if not found:
+        failures.append("no ```python code block")
+    elif blocks is not None and len(found) != blocks:
+        failures.append(f"{len(found)} python code blocks (expected {blocks})")
+    if found and not facts["syntax_ok"]:
+        failures.append(f"code does not parse ({facts['syntax_error']})")
+    if facts["asserts"] < min_asserts:
+        failures.append(f"{facts['asserts']} asserts (need >= {min_asserts})")
+    if facts["tests"] < min_tests:
+        failures.append(f"{facts['tests']} test_* functions (need >= {min_tests})")
+    if facts["raises"] < min_raises:
+        failures.append(f"{facts['raises']} exception checks such as pytest.raises (need >= {min_raises})")
+    facts["failures"] = failures
+    facts["ok"] = not failures
+    return facts
+
+
+def check_commit_messages(text: str, count: Optional[int] = None, ticket: Optional[str] = None,
+                          require_scope: bool = True, max_subject_chars: Optional[int] = 72) -> dict:
+    """
+    Checks Conventional Commit subjects ("type(scope): subject") in an answer: how many
+    there are, and whether each has a scope, the ticket and a short enough subject line
+    (measured from the type, without list / markdown decoration).
+    """
+    subjects = [m for m in _COMMIT_SUBJECT.finditer(text)]
+    facts = {
+        "messages": len(subjects),
+        "without_scope": sum(1 for m in subjects if not m.group("scope")),
+        "without_ticket": sum(1 for m in subjects if ticket and ticket not in m.group("subject")),
+        "long_subjects": sum(
+            1 for m in subjects
+            if max_subject_chars and m.end("subject") - m.start("type") > max_subject_chars
+        ),
+    }
+
+    failures = []
+    if count is not None and facts["messages"] != count:
+        failures.append(f"{facts['messages']} conventional commit messages (expected {count})")
+    elif not subjects:
+        failures.append("no conventional commit messages")
+    if require_scope and facts["without_scope"]:
+        failures.append(f"{facts['without_scope']} messages without a (scope)")
+    if facts["without_ticket"]:
+        failures.append(f"{facts['without_ticket']} subjects without {ticket}")
+    if facts["long_subjects"]:
+        failures.append(f"{facts['long_subjects']} subjects longer than {max_subject_chars} chars")
+    facts["failures"] = failures
+    facts["ok"] = not failures
+    return facts
@@ -0,0 +1,221 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from telemetry import queue_wait
+
+
+class ConcurrencyLimit:
+    """
+    Async semaphore whose limit can be changed at runtime.
+    Thread-safe, and usable from any event loop (waiters are woken on their own loop).
+    """
+
+    def __init__(self, limit: int):
+        self._limit = max(1, int(limit))
+        self._inflight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def set_limit(self, limit: int):
+        with self._lock:
+            self._limit = max(1, int(limit))
+            self._wake_locked()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._inflight < self._limit and not self._waiters:
+                self._inflight += 1
+                return
+            fut = loop.create_future()
+            self._waiters.append((loop, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, fut))
+                except ValueError:
+                    pass
+            # Slot was granted just before we got cancelled -> hand it back
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._inflight = max(0, self._inflight - 1)
+            self._wake_locked()
+
+    def _wake_locked(self):
+        while self._waiters and self._inflight < self._limit:
+            loop, fut = self._waiters.popleft()
+            self._inflight += 1
+            loop.call_soon_threadsafe(self._grant, fut)
+
+    def _grant(self, fut):
+        if fut.cancelled():
+            self.release()
+        elif not fut.done():
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AIMDLimit(ConcurrencyLimit):
+    """
+    Concurrency limit that adapts to provider feedback (additive increase / multiplicative decrease):
+      - each success raises the limit by `increase / limit` (about +increase per full window)
+      - each 429/5xx-type failure multiplies it by `decrease`, at most once per `cooldown_sec`
+        so one burst of rejections does not collapse the limit to the floor
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 increase: float = 1.0, decrease: float = 0.5, cooldown_sec: float = 2.0,
+                 window: int = 100):
+        super().__init__(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown_sec = cooldown_sec
+        self._value = float(max(min_limit, min(max_limit, initial)))
+        self._last_decrease = 0.0
+        self._outcomes = deque(maxlen=window)
+        self.set_limit(int(self._value))
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._outcomes.append(bool(ok))
+            if ok:
+                self._value = min(self.max_limit, self._value + self.increase / max(1.0, self._value))
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease < self.cooldown_sec:
+                    return
+                self._last_decrease = now
+                self._value = max(self.min_limit, self._value * self.decrease)
+            self._limit = max(1, int(self._value))
+            self._wake_locked()
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return self._outcomes.count(False) / len(self._outcomes)
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "inflight": self.inflight, "error_rate": self.error_rate()}
+
+
+# ---- Process-wide request caps used by retry_helpers (None = unlimited)
+_global_limit: Optional[ConcurrencyLimit] = None
+_model_limits: Dict[str, ConcurrencyLimit] = {}
+_adaptive_defaults: Optional[dict] = None
+_registry_lock = threading.Lock()
+
+
+def configure_request_limits(global_limit: Optional[int] = None,
+                             per_model: Optional[Dict[str, int]] = None):
+    """
+    Caps the number of chat-completion requests in flight: across all models
+    (global_limit) and/or per model name (per_model). Passing None removes a cap.
+    """
+    global _global_limit, _adaptive_defaults
+    with _registry_lock:
+        _global_limit = ConcurrencyLimit(global_limit) if global_limit else None
+        _adaptive_defaults = None
+        _model_limits.clear()
+        for model, limit in (per_model or {}).items():
+            _model_limits[model] = ConcurrencyLimit(limit)
+
+
+def configure_adaptive_limits(initial: Optional[Dict[str, int]] = None, default_initial: Optional[int] = 8,
+                              **aimd_kwargs):
+    """
+    Switches per-model caps to AIMD limits driven by request outcomes.
+    `initial` seeds specific models; other models get an AIMDLimit starting at
+    `default_initial` the first time they are used (None = leave them uncapped).
+    aimd_kwargs (min_limit, max_limit, increase, decrease, cooldown_sec) go to AIMDLimit.
+    """
+    global _adaptive_defaults
+    with _registry_lock:
+        _adaptive_defaults = dict(aimd_kwargs, initial=default_initial) if default_initial else None
+        for model, limit in (initial or {}).items():
+            _model_limits[model] = AIMDLimit(limit, **aimd_kwargs)
+
+
+def get_model_limit(model: str) -> Optional[ConcurrencyLimit]:
+    limit = _model_limits.get(model)
+    if limit is None and _adaptive_defaults is not None and model:
+        with _registry_lock:
+            limit = _model_limits.get(model)
+            if limit is None and _adaptive_defaults is not None:
+                limit = _model_limits[model] = AIMDLimit(**_adaptive_defaults)
+    return limit
+
+
+def record_outcome(model: str, ok: bool):
+    """
+    Feeds one request outcome to the model's adaptive limit (no-op for static caps).
+    ok=False should only be reported for throttling/overload errors (429, 5xx, timeouts).
+    """
+    limit = _model_limits.get(model)
+    if isinstance(limit, AIMDLimit):
+        limit.record(ok)
+
+
+def limit_stats() -> Dict[str, dict]:
+    """
+    Current per-model cap, in-flight count and (adaptive limits) recent error rate.
+    """
+    out = {}
+    for model, limit in list(_model_limits.items()):
+        if isinstance(limit, AIMDLimit):
+            out[model] = limit.stats()
+        else:
+            out[model] = {"limit": limit.limit, "inflight": limit.inflight}
+    return out
+
+
+@asynccontextmanager
+async def request_slot(model: str):
+    """
+    Holds one in-flight request slot for `model` (per-model cap first, then the global cap).
+    Time spent waiting for a slot is counted as the active run's queue wait (telemetry).
+    """
+    model_limit = get_model_limit(model)
+    global_limit = _global_limit
+    if model_limit is not None:
+        with queue_wait():
+            await model_limit.acquire()
+    try:
+        if global_limit is not None:
+            with queue_wait():
+                await global_limit.acquire()
+        try:
+            yield
+        finally:
+            if global_limit is not None:
+                global_limit.release()
+    finally:
+        if model_limit is not None:
+            model_limit.release()
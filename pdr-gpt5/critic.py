@@ -1,14 +1,30 @@
 import openai
 from typing import List, Dict, Any, Optional, Tuple
 
-from retry_helpers import chat_with_retries
+from retry_helpers import achat_with_circuit_fallback, achat_with_retries
+from circuit_breaker import CircuitOpenError
+from async_runner import run_sync
+from budget_learner import answering_model, completion_tokens, first_attempt_budget, get_budget_learner
+from json_reply import clip_list, clip_text, parse_json_reply
 
 
 class LLMCritic:
     """
     LLM-based critic that labels each output given instructions.
+
+    The report is parsed JSON keyed by 0-based output index:
+    {i: {"strengths": [...], "weaknesses": [...], "fix_next": [...], "notes": str}}.
+    Lists hold at most MAX_ITEMS items of MAX_ITEM_CHARS characters and notes at most
+    MAX_NOTES_CHARS, so callers can quote a candidate's entry without truncating.
     """
 
+    MAX_ITEMS = 3
+    MAX_ITEM_CHARS = 160
+    MAX_NOTES_CHARS = 300
+    # Reply budget per output when max_tokens is not given: a full entry is about
+    # 3 lists x 3 items x 160 chars + 300 chars of notes (~1.8k chars) plus JSON syntax
+    TOKENS_PER_OUTPUT = 450
+
     _NO_TEMPERATURE_MODELS = {"gpt-4o", "gpt-5-mini", "gpt-4o-mini"}
     _HAS_VERBOSITY_MODELS = {"gpt-4o", "gpt-5-mini"}
 
@@ -22,19 +38,30 @@ class LLMCritic:
         max_comp_tokens: int,
         # reasoning_effort: str = "minimal",
         verbosity: Optional[str] = "medium",
+        model: Optional[str] = None,
     ) -> Dict[str, Any]:
+        model = model or self.model
         kwargs: Dict[str, Any] = {
-            "model": self.model,
+            "model": model,
             "messages": messages,
             "max_completion_tokens": max_comp_tokens,
             # "reasoning_effort": reasoning_effort,
         }
-        if self.temperature is not None and self.model not in self._NO_TEMPERATURE_MODELS:
+        if self.temperature is not None and model not in self._NO_TEMPERATURE_MODELS:
             kwargs["temperature"] = self.temperature
-        if verbosity is not None and self.model in self._HAS_VERBOSITY_MODELS:
+        if verbosity is not None and model in self._HAS_VERBOSITY_MODELS:
             kwargs["verbosity"] = verbosity
         return kwargs
 
+    def _route_kwargs(self, kwargs: Dict[str, Any], model: str) -> Dict[str, Any]:
+        # Same request re-targeted at a fallback model (circuit breaker routing)
+        routed = {**kwargs, "model": model}
+        if model in self._NO_TEMPERATURE_MODELS:
+            routed.pop("temperature", None)
+        if model not in self._HAS_VERBOSITY_MODELS:
+            routed.pop("verbosity", None)
+        return routed
+
     def _format_outputs(self, outputs: List[str]) -> str:
         text = ""
         for i, out in enumerate(outputs):
@@ -50,33 +77,78 @@ class LLMCritic:
         reasoning_used = comp_details.get("reasoning_tokens", 0)
         return content.strip(), finish_reason, reasoning_used
 
-    def critique_outputs(
+    def _entry(self, raw: Any) -> Dict[str, Any]:
+        if not isinstance(raw, dict):
+            raw = {"notes": raw}
+        return {
+            "strengths": clip_list(raw.get("strengths"), self.MAX_ITEMS, self.MAX_ITEM_CHARS),
+            "weaknesses": clip_list(raw.get("weaknesses"), self.MAX_ITEMS, self.MAX_ITEM_CHARS),
+            "fix_next": clip_list(raw.get("fix_next"), self.MAX_ITEMS, self.MAX_ITEM_CHARS),
+            "notes": clip_text(raw.get("notes"), self.MAX_NOTES_CHARS),
+        }
+
+    def _entries(self, raw: Any, k: int) -> Dict[int, Dict[str, Any]]:
+        """
+        Per-output entries from a reply's "outputs" field (keyed "1".."k" or a list).
+        """
+        if isinstance(raw, list):
+            raw = {str(i + 1): e for i, e in enumerate(raw)}
+        if not isinstance(raw, dict):
+            raw = {}
+        return {i: self._entry(raw.get(str(i + 1)) or {}) for i in range(k)}
+
+    def _parse_report(self, content: str, k: int) -> Optional[Dict[int, Dict[str, Any]]]:
+        obj = parse_json_reply(content)
+        if not isinstance(obj, dict):
+            return None
+        outputs = obj.get("outputs", obj)  # tolerate the entries at the top level
+        if isinstance(outputs, dict) and not any(str(i + 1) in outputs for i in range(k)):
+            return None
+        if not isinstance(outputs, (dict, list)) or not outputs:
+            return None
+        return self._entries(outputs, k)
+
+    def _unstructured_report(self, content: str, k: int) -> Dict[int, Dict[str, Any]]:
+        # Last resort for a reply that never parsed: keep a bounded excerpt as every entry's notes
+        return {i: self._entry({"notes": content}) for i in range(k)}
+
+    def critique_outputs(self, outputs: List[str], instructions: str, **kwargs) -> Dict[int, Dict[str, Any]]:
+        """
+        Blocking wrapper around acritique_outputs (same keyword arguments).
+        """
+        return run_sync(self.acritique_outputs(outputs, instructions, **kwargs))
+
+    async def acritique_outputs(
         self,
         outputs: List[str],
         instructions: str,
         *,
-        max_tokens: int = 1200,
+        max_tokens: Optional[int] = None,   # None = TOKENS_PER_OUTPUT per output
         max_retries: int = 1,               # content-based retry
         network_attempts: int = 6,          # 5xx/429/network retries
         request_timeout: int = 90,          # seconds
         allow_model_fallback: bool = True,  # optionally switch model if GPT-4o still empty
         fallback_models: Tuple[str, ...] = ("gpt-4o",),
         debug: bool = False,
-    ) -> str:
+        cache_bypass: bool = False,         # skip the shared response cache
+        budget_key: Optional[str] = None,   # e.g. task name: learn the first-attempt max_tokens
+    ) -> Dict[int, Dict[str, Any]]:
         """
-        Returns a textual 'critic report'. If the first attempt is empty/truncated,
-        retries with stronger constraints and a larger token budget.
+        Returns the critic report (see class docstring). If the first attempt is empty,
+        truncated or not parsable JSON, retries with stronger constraints and a larger
+        token budget; a reply that never parses degrades to its excerpt in "notes".
+        With a budget learner configured and a budget_key, the first attempt uses the
+        learned budget (see budget_learner.BudgetLearner).
         """
+        if max_tokens is None:
+            max_tokens = self.TOKENS_PER_OUTPUT * max(1, len(outputs))
 
         messages = [
             {
                 "role": "system",
                 "content": (
-                    "You are an objective, detailed critic. For each output, provide:"
-                    "\n- Strengths"
-                    "\n- Weaknesses"
-                    "\n- Concrete improvements"
-                    "\nBe concise and structured."
+                    "You are an objective, detailed critic. "
+                    "Return ONLY one compact JSON object. No markdown, no code fences, no extra text."
                 )
             },
             {
@@ -84,38 +156,54 @@ class LLMCritic:
                 "content": (
                     f"Instructions:\n{instructions}\n\n"
                     "Below are multiple outputs. For each output, label strengths, weaknesses, "
-                    "and an overall recommendation for improvement.\n\n"
+                    "and the concrete changes to make in its next version. Reply with JSON of the form:\n"
+                    '{"outputs": {"1": {"strengths": ["<= 3 short items"], "weaknesses": ["<= 3 short items"], '
+                    '"fix_next": ["<= 3 concrete changes"], "notes": "<= 40 words"}, ...}}\n\n'
                     + self._format_outputs(outputs)
                 )
             }
         ]
 
+        if budget_key is not None:
+            budget_key = f"critic/{budget_key}"  # needs differ per caller role
+        learner = get_budget_learner() if budget_key is not None else None
+        first_budget = first_attempt_budget(self.model, budget_key, max_tokens)
+
         try:
             # --- Attempt 1: minimal reasoning, low verbosity
             kwargs1 = self._make_kwargs(
                 messages=messages,
-                max_comp_tokens=max_tokens,
+                max_comp_tokens=first_budget,
                 # reasoning_effort="minimal",
                 verbosity="medium",
             )
-            resp1 = chat_with_retries(
+            resp1 = await achat_with_circuit_fallback(
+                kwargs1,
+                fallback_models if allow_model_fallback else (),
+                reroute=self._route_kwargs,
                 max_attempts=network_attempts,
                 request_timeout=request_timeout,
-                **kwargs1
+                cache_bypass=cache_bypass,
             )
             if debug:
                 print("CRITIC REQUEST 1 (no messages shown):", {k: v for k, v in kwargs1.items() if k != "messages"})
                 print("CRITIC RESPONSE 1:", resp1)
 
+            n_outputs = len(outputs)
             content, finish_reason, reasoning_used = self._extract(resp1)
-            if content:
-                return content
+            if learner is not None:
+                learner.record(answering_model(resp1, self.model), budget_key, first_budget, completion_tokens(resp1),
+                               truncated=finish_reason == "length" or not content)
+            report = self._parse_report(content, n_outputs)
+            if report is not None:
+                return report
 
-            # Decide on retry if empty/length/heavy reasoning
+            # Decide on retry if empty/length/heavy reasoning/not JSON
             should_retry = (
                 finish_reason == "length" or
-                reasoning_used >= max(128, int(0.8 * max_tokens)) or
-                not content
+                reasoning_used >= max(128, int(0.8 * first_budget)) or
+                not content or
+                report is None
             )
 
             if should_retry and max_retries > 0:
@@ -123,13 +211,13 @@ class LLMCritic:
                     {
                         "role": "system",
                         "content": (
-                            "Return ONLY the critic report now. Be concise, bullet the strengths/weaknesses, "
-                            "and provide concrete improvements for each output. Do NOT include chain-of-thought."
+                            "Return ONLY the JSON critic report now, in the requested form, with short "
+                            "strengths/weaknesses/fix_next items for each output. Do NOT include chain-of-thought."
                         ),
                     },
                     *messages,
                 ]
-                bigger_budget = max(3000, int(max_tokens * 2))
+                bigger_budget = max(1500, int(max_tokens * 2))
 
                 kwargs2 = self._make_kwargs(
                     messages=retry_messages,
@@ -137,45 +225,58 @@ class LLMCritic:
                     # reasoning_effort="minimal",
                     verbosity="medium",
                 )
-                resp2 = chat_with_retries(
+                resp2 = await achat_with_circuit_fallback(
+                    kwargs2,
+                    fallback_models if allow_model_fallback else (),
+                    reroute=self._route_kwargs,
                     max_attempts=network_attempts,
                     request_timeout=request_timeout,
-                    **kwargs2
+                    cache_bypass=cache_bypass,
                 )
                 if debug:
                     print("CRITIC REQUEST 2 (no messages shown):", {k: v for k, v in kwargs2.items() if k != "messages"})
                     print("CRITIC RESPONSE 2:", resp2)
 
                 content2, finish2, reasoning2 = self._extract(resp2)
-                if content2:
-                    return content2
+                if content2 and learner is not None and finish2 != "length":
+                    learner.record_need(answering_model(resp2, self.model), budget_key, completion_tokens(resp2))
+                report = self._parse_report(content2, n_outputs)
+                if report is not None:
+                    return report
 
                 # Optional: fall back to a non-reasoning model (e.g., gpt-4o)
+                # (fallback model passed explicitly; self.model is never swapped, so
+                # concurrent critiques sharing this critic stay isolated)
                 if allow_model_fallback:
                     for fb_model in fallback_models:
-                        prev_model = self.model
+                        kwargs_fb = self._make_kwargs(
+                            messages=retry_messages,
+                            max_comp_tokens=max_tokens,
+                            # reasoning_effort="minimal",  # harmless for non-reasoning models
+                            verbosity=None,              # only pass where supported
+                            model=fb_model,
+                        )
                         try:
-                            self.model = fb_model
-                            kwargs_fb = self._make_kwargs(
-                                messages=retry_messages,
-                                max_comp_tokens=max_tokens,
-                                # reasoning_effort="minimal",  # harmless for non-reasoning models
-                                verbosity=None,              # only pass where supported
-                            )
-                            resp_fb = chat_with_retries(
+                            resp_fb = await achat_with_retries(
                                 max_attempts=network_attempts,
                                 request_timeout=request_timeout,
+                                cache_bypass=cache_bypass,
                                 **kwargs_fb
                             )
-                            if debug:
-                                print(f"CRITIC FALLBACK {fb_model}:", {k: v for k, v in kwargs_fb.items() if k != "messages"})
-                                print(f"CRITIC FALLBACK {fb_model} RESP:", resp_fb)
+                        except CircuitOpenError:
+                            continue  # this fallback is degraded too; try the next one
+                        if debug:
+                            print(f"CRITIC FALLBACK {fb_model}:", {k: v for k, v in kwargs_fb.items() if k != "messages"})
+                            print(f"CRITIC FALLBACK {fb_model} RESP:", resp_fb)
+
+                        content_fb, _, _ = self._extract(resp_fb)
+                        report = self._parse_report(content_fb, n_outputs)
+                        if report is not None:
+                            return report
+                        content2 = content2 or content_fb
 
-                            content_fb, _, _ = self._extract(resp_fb)
-                            if content_fb:
-                                return content_fb
-                        finally:
-                            self.model = prev_model
+                if content2 or content:
+                    return self._unstructured_report(content2 or content, n_outputs)
 
                 # Exhausted retries & fallbacks
                 raise RuntimeError(
@@ -184,6 +285,9 @@ class LLMCritic:
                     f"max_completion_tokens={bigger_budget}"
                 )
 
+            if content:
+                return self._unstructured_report(content, n_outputs)
+
             # No retry warranted, but empty → raise
             raise RuntimeError(
                 f"Empty critic completion from {self.model}. "
@@ -1,58 +1,162 @@
-import openai
+import asyncio
+
+from async_runner import run_sync
+from code_checks import extract_code_blocks
+from pytest_sandbox import get_sandbox
+from retry_helpers import achat_with_retries
+from rubric import compile_rubric
+
+
+class EvaluationResult(dict):
+    """
+    Evaluation dict whose "analysis" is computed on first use.
+
+    The rule-based keys are filled in immediately. The LLM analysis runs the first time it
+    is needed: `await aensure_analysis(result)` from async code, or plain result["analysis"] /
+    result.get("analysis") from sync code (outside the shared event loop). Results whose
+    analysis is never consulted never make the call.
+    """
+
+    def __init__(self, data: dict, compute_analysis=None):
+        super().__init__(data)
+        self._compute_analysis = compute_analysis
+        self._pending = None
+
+    async def aensure_analysis(self) -> str:
+        if not dict.__contains__(self, "analysis"):
+            if self._pending is None:
+                self._pending = asyncio.ensure_future(self._compute_analysis())
+            self["analysis"] = await self._pending
+        return self["analysis"]
+
+    def __missing__(self, key):
+        if key == "analysis" and self._compute_analysis is not None:
+            return run_sync(self.aensure_analysis())
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key == "analysis" and self._compute_analysis is not None:
+            return self[key]
+        return super().get(key, default)
+
+
+async def aensure_analysis(results: dict) -> str:
+    """
+    The (possibly lazy) analysis of an evaluation result, computed now if still pending.
+    """
+    if isinstance(results, EvaluationResult):
+        return await results.aensure_analysis()
+    return results.get("analysis", "")
+
 
 class Evaluator:
     """
     Evaluates a participant's output against a given rubric,
     returning a numeric score and optional GPT-4o analysis.
     """
-    def __init__(self, use_gpt5_for_eval: bool = True, model: str = "gpt-4o"):
+    def __init__(self, use_gpt5_for_eval: bool = True, model: str = "gpt-4o", lazy_analysis: bool = True):
         self.use_gpt5_for_eval = use_gpt5_for_eval
         self.model = model
+        # Defer the GPT-4o analysis until a caller actually reads it (see EvaluationResult)
+        self.lazy_analysis = lazy_analysis
 
-    def evaluate_output(self, output_text: str, rubric: dict) -> dict:
+    def evaluate_output(self, output_text: str, rubric) -> dict:
+        """
+        Blocking wrapper around aevaluate_output.
+        """
+        return run_sync(self.aevaluate_output(output_text, rubric))
+
+    async def aevaluate_output(self, output_text: str, rubric) -> dict:
         """
         Returns a dict with keys:
           - 'word_count_ok': bool
           - 'must_include_ok': bool
+          - 'missing_keywords': list of must_include entries not found
+          - 'checks' / 'checks_ok' / 'check_failures': the rubric's extra checks (regex, headers, code, ...)
+          - 'tests': pass/fail counts from running generated tests (rubric "execute_tests",
+            only with a sandbox configured, see pytest_sandbox.configure_sandbox)
+          - 'decisive': deterministic checks settled the result; 'analysis' then comes
+            from them and no GPT-4o call is made
           - 'score': int
           - 'analysis': str (optional, GPT-4o analysis)
+        `rubric` is a rubric dict or, preferably, a precompiled task.compiled_rubric.
+        With lazy_analysis (default) the result is an EvaluationResult and the GPT-4o
+        call happens only when 'analysis' is first used (see aensure_analysis).
+        """
+        compiled = compile_rubric(rubric)
+        return await self._afinish(output_text, compiled, compiled.check(output_text))
+
+    async def aevaluate_outputs(self, output_texts: list, rubric) -> list:
+        """
+        Scores a batch of candidates against one compiled rubric; same result dicts as
+        aevaluate_output (analyses stay lazy, so unconsulted candidates cost no call).
+        """
+        compiled = compile_rubric(rubric)
+        results = compiled.check_batch(output_texts)
+        return list(await asyncio.gather(*(
+            self._afinish(text, compiled, res) for text, res in zip(output_texts, results)
+        )))
+
+    async def _aexecute_tests(self, output_text: str, compiled, results: dict):
         """
-        # 1) Word count check
-        words = output_text.split()
-        word_count = len(words)
-        min_count, max_count = rubric["word_count_range"]
-        word_count_ok = (min_count <= word_count <= max_count)
-
-        # 2) Must-include check
-        all_keywords_present = True
-        for kw in rubric.get("must_include", []):
-            if kw.lower() not in output_text.lower():
-                all_keywords_present = False
-                break
-
-        # Simple scoring approach
-        base_score = 50
-        if word_count_ok:
-            base_score += 25
-        if all_keywords_present:
-            base_score += 25
-
-        results = {
-            "word_count_ok": word_count_ok,
-            "must_include_ok": all_keywords_present,
-            "score": base_score
-        }
-
-        # 3) Optional GPT-4o analysis
+        Runs the answer's pytest module against the rubric's reference implementation
+        (rubric "execute_tests", sandbox configured) and folds the outcome into the score:
+        the "tests_pass" check needs at least one collected test and no failures.
+        """
+        spec, sandbox = compiled.execute_tests, get_sandbox()
+        if spec is None or sandbox is None:
+            return
+        blocks = extract_code_blocks(output_text, ("python", "py"))
+        if not blocks:
+            return
+        run = await sandbox.arun_tests("\n\n".join(blocks), spec["reference_source"], spec["function"])
+        if run is None:
+            return  # nothing runnable; the python_code check already reports why
+        results["tests"] = run
+        failures = []
+        if run["limit_hit"]:
+            failures.append(f"test run stopped ({run['limit_hit']} limit)")
+        elif run["collected"] == 0:
+            failures.append("no tests were collected")
+        if run["failed"] or run["errors"]:
+            failures.append(
+                f"{run['failed'] + run['errors']} of {max(run['collected'], 1)} tests fail against a correct "
+                f"{spec['function']} ({', '.join(run['failed_tests'][:5]) or 'collection error'})"
+            )
+        compiled.add_check(results, "tests_pass", not failures, failures)
+
+    async def _afinish(self, output_text: str, compiled, results: dict) -> dict:
+        await self._aexecute_tests(output_text, compiled, results)
+        if results.get("decisive"):
+            # Deterministic checks already settle pass/fail: their findings replace the LLM call
+            results["analysis"] = self._deterministic_analysis(results)
+            return results
+
+        # Optional GPT-4o analysis
+        instructions = compiled.evaluation_instructions
+        if self.use_gpt5_for_eval and self.lazy_analysis:
+            return EvaluationResult(results, lambda: self._agpt5_qualitative_eval(output_text, instructions))
         if self.use_gpt5_for_eval:
-            analysis_text = self._gpt5_qualitative_eval(output_text, rubric["evaluation_instructions"])
-            results["analysis"] = analysis_text
+            results["analysis"] = await self._agpt5_qualitative_eval(output_text, instructions)
         else:
             results["analysis"] = "No GPT-4o evaluation performed."
-
         return results
 
+    @staticmethod
+    def _deterministic_analysis(results: dict) -> str:
+        problems = list(results.get("check_failures", []))
+        if results.get("missing_keywords"):
+            problems.append("missing required keywords: " + ", ".join(results["missing_keywords"]))
+        if not results.get("word_count_ok", True):
+            problems.append(f"word count {results.get('word_count')} is out of range")
+        if not problems:
+            return "Deterministic checks: all rubric checks passed."
+        return "Deterministic checks failed: " + "; ".join(problems) + "."
+
     def _gpt5_qualitative_eval(self, output_text: str, instructions: str) -> str:
+        return run_sync(self._agpt5_qualitative_eval(output_text, instructions))
+
+    async def _agpt5_qualitative_eval(self, output_text: str, instructions: str) -> str:
         """
         Calls GPT-4o with instructions to produce a qualitative analysis.
         """
@@ -70,7 +174,10 @@ class Evaluator:
         ]
 
         try:
-            response = openai.ChatCompletion.create(
+            # Single attempt (no network retries), but through the shared call layer
+            # so deterministic temperature=0 evaluations are served from the response cache
+            response = await achat_with_retries(
+                max_attempts=1,
                 model=self.model,
                 messages=messages,
                 temperature=0,
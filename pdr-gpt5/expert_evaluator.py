@@ -1,8 +1,11 @@
-import openai
-import json
 import re
 from typing import Optional, Dict, Any, List
 
+from async_runner import run_sync
+from retry_helpers import achat_with_retries
+from budget_learner import answering_model, completion_tokens, first_attempt_budget, get_budget_learner
+from json_reply import parse_json_reply
+
 
 class ExpertEvaluator:
     """
@@ -51,17 +54,10 @@ class ExpertEvaluator:
 
     @staticmethod
     def _parse_json_scores(raw: str) -> Optional[Dict[str, Any]]:
-        raw = (raw or "").strip()
-        if not raw:
+        obj = parse_json_reply(raw)
+        if not isinstance(obj, dict):
             return None
-
-        # Strip code fences if present
-        if raw.startswith("```"):
-            raw = re.sub(r"^```[a-zA-Z0-9_+-]*\n", "", raw)
-            raw = re.sub(r"\n```$", "", raw)
-
         try:
-            obj = json.loads(raw)
             c = ExpertEvaluator._clamp_0_5(obj.get("correctness_score", 0))
             s = ExpertEvaluator._clamp_0_5(obj.get("style_score", 0))
             notes = str(obj.get("notes", "")).strip()
@@ -85,16 +81,25 @@ class ExpertEvaluator:
             kwargs["temperature"] = self.temperature
         return kwargs
 
-    def evaluate_as_expert(
+    def evaluate_as_expert(self, output_text: str, domain: str = "general", **kwargs) -> dict:
+        """
+        Blocking wrapper around aevaluate_as_expert (same keyword arguments).
+        """
+        return run_sync(self.aevaluate_as_expert(output_text, domain, **kwargs))
+
+    async def aevaluate_as_expert(
         self,
         output_text: str,
         domain: str = "general",
         max_tokens: int = 400,
         max_retries: int = 1,
         debug: bool = False,
+        budget_key: Optional[str] = None,
     ) -> dict:
         """
         Evaluate with compact JSON-only output. Retries once with a stronger nudge / bigger budget if needed.
+        With a budget learner configured and a budget_key, the first attempt uses the
+        learned budget (see budget_learner.BudgetLearner).
         """
         system_msg = (
             "You are a strict domain expert grader. "
@@ -116,14 +121,19 @@ class ExpertEvaluator:
             {"role": "user", "content": user_msg},
         ]
 
+        if budget_key is not None:
+            budget_key = f"expert/{budget_key}"  # needs differ per caller role
+        learner = get_budget_learner() if budget_key is not None else None
+        first_budget = first_attempt_budget(self.model, budget_key, max_tokens)
+
         try:
             # Attempt 1
             kwargs = self._make_kwargs(
                 messages=base_messages,
-                max_comp_tokens=max_tokens,
+                max_comp_tokens=first_budget,
                 # reasoning_effort="minimal",
             )
-            resp = openai.ChatCompletion.create(**kwargs)
+            resp = await achat_with_retries(max_attempts=1, **kwargs)
             if debug:
                 print("EVAL REQUEST 1:", kwargs)
                 print("EVAL RESPONSE 1:", resp)
@@ -131,6 +141,9 @@ class ExpertEvaluator:
             choice = resp["choices"][0]
             content = (choice.get("message") or {}).get("content") or ""
             parsed = self._parse_json_scores(content)
+            if learner is not None:
+                learner.record(answering_model(resp, self.model), budget_key, first_budget, completion_tokens(resp),
+                               truncated=choice.get("finish_reason") == "length" or not content.strip())
 
             if parsed:
                 return parsed
@@ -148,7 +161,7 @@ class ExpertEvaluator:
             should_retry = (
                 not content.strip() or
                 finish_reason == "length" or
-                reasoning_used >= max(64, int(0.8 * max_tokens))
+                reasoning_used >= max(64, int(0.8 * first_budget))
             )
 
             if should_retry and max_retries > 0:
@@ -170,7 +183,7 @@ class ExpertEvaluator:
                     max_comp_tokens=bigger,
                     # reasoning_effort="minimal",
                 )
-                resp2 = openai.ChatCompletion.create(**kwargs2)
+                resp2 = await achat_with_retries(max_attempts=1, **kwargs2)
                 if debug:
                     print("EVAL REQUEST 2:", kwargs2)
                     print("EVAL RESPONSE 2:", resp2)
@@ -178,6 +191,8 @@ class ExpertEvaluator:
                 content2 = (resp2["choices"][0]["message"] or {}).get("content") or ""
 
                 parsed2 = self._parse_json_scores(content2)
+                if learner is not None and resp2["choices"][0].get("finish_reason") != "length":
+                    learner.record_need(answering_model(resp2, self.model), budget_key, completion_tokens(resp2))
                 if parsed2:
                     return parsed2
 
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Dict, Optional
+
+from telemetry import current_run
+
+
+class HedgePolicy:
+    """
+    Latency-percentile hedging for slow requests.
+
+    Latencies of recent calls are tracked per model. A hedge-eligible request that
+    has not returned after the model's `percentile` latency gets one duplicate;
+    the first successful reply wins and the other is cancelled. Duplicates are
+    limited to `max_extra_ratio` of hedge-eligible requests, so spend grows by at
+    most that fraction. No hedging until `min_samples` latencies have been seen.
+    """
+
+    def __init__(self, percentile: float = 0.95, min_samples: int = 20, window: int = 200,
+                 max_extra_ratio: float = 0.1, min_delay_sec: float = 1.0):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_extra_ratio = max_extra_ratio
+        self.min_delay_sec = min_delay_sec
+        self._latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe(self, model: str, latency_sec: float):
+        with self._lock:
+            self._latencies[model].append(latency_sec)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get(model) or ())
+        if len(samples) < self.min_samples:
+            return None
+        idx = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return max(self.min_delay_sec, samples[idx])
+
+    def _try_spend(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_extra_ratio * max(1, self.requests):
+                return False
+            self.hedges += 1
+            return True
+
+    async def run(self, model: str, make_request: Callable[[], Awaitable]):
+        """
+        Awaits make_request(), issuing one duplicate if it is slower than the learned
+        percentile and the extra-request budget allows.
+        """
+        with self._lock:
+            self.requests += 1
+        delay = self.hedge_delay(model)
+        primary = asyncio.ensure_future(make_request())
+        pending = {primary}
+        try:
+            if delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._try_spend():
+                return await primary
+
+            run = current_run()
+            if run is not None:
+                run.hedged_requests += 1
+            backup = asyncio.ensure_future(make_request())
+            pending = {primary, backup}
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            # Also reached when the caller is cancelled mid-wait: never orphan a request
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "extra_ratio": self.hedges / self.requests if self.requests else 0.0,
+            }
+
+
+# ---- Process-wide policy used by retry_helpers (None = hedging off)
+_policy: Optional[HedgePolicy] = None
+
+
+def configure_hedging(enabled: bool = True, **kwargs) -> Optional[HedgePolicy]:
+    """
+    Turns hedging on for hedge-eligible calls (Participant generations); kwargs go to HedgePolicy.
+    """
+    global _policy
+    _policy = HedgePolicy(**kwargs) if enabled else None
+    return _policy
+
+
+def get_hedge_policy() -> Optional[HedgePolicy]:
+    return _policy
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+import openai
+
+# Filled by the aiohttp trace hook with the headers of the response being awaited
+_response_headers: ContextVar[Optional[dict]] = ContextVar("pdr_response_headers", default=None)
+
+
+class HttpPool:
+    """
+    Keep-alive connection pools for the openai 0.27 client, shared by every LLM caller.
+
+    openai 0.27 opens a fresh aiohttp.ClientSession (and TLS handshake) per acreate unless
+    openai.aiosession is set, so each event loop gets one long-lived session whose
+    TCPConnector enforces `limit` / `limit_per_host` and keeps idle sockets for
+    `keepalive_timeout` seconds. Every call goes through acreate (the sync
+    chat_with_retries runs the async path), so no requests session is pooled.
+
+    aiohttp trace hooks count new vs reused connections, and capture response headers
+    (dropped from successful responses by openai 0.27) for the rate limiter.
+    aiohttp is imported lazily; it ships as a dependency of openai 0.27.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 32, keepalive_timeout: float = 60.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self._sessions: Dict[asyncio.AbstractEventLoop, object] = {}
+        self._lock = threading.Lock()
+
+    def _trace_config(self):
+        import aiohttp
+
+        async def on_create(session, ctx, params):
+            with self._lock:
+                self.connections_created += 1
+
+        async def on_reuse(session, ctx, params):
+            with self._lock:
+                self.connections_reused += 1
+
+        async def on_request_end(session, ctx, params):
+            with self._lock:
+                self.requests += 1
+            sink = _response_headers.get()
+            if sink is not None:
+                sink.update(params.response.headers)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_request_end.append(on_request_end)
+        return trace
+
+    def session(self):
+        """
+        The pooled aiohttp session of the running event loop (created on first use).
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                import aiohttp
+
+                # Forget sessions whose loop is gone (e.g. earlier asyncio.run calls)
+                for old in [l for l in self._sessions if l.is_closed()]:
+                    del self._sessions[old]
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+                session = aiohttp.ClientSession(connector=connector, trace_configs=[self._trace_config()])
+                self._sessions[loop] = session
+            return session
+
+    def stats(self) -> dict:
+        with self._lock:
+            reuse = self.connections_reused / self.requests if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "connections_created": self.connections_created,
+                "connections_reused": self.connections_reused,
+                "reuse_ratio": reuse,
+            }
+
+    def close(self):
+        """
+        Closes every pooled session. Call from outside the event loops (e.g. after
+        scheduler.run returns), not from a coroutine running on one of them.
+        """
+        with self._lock:
+            sessions = list(self._sessions.items())
+            self._sessions.clear()
+        for loop, session in sessions:
+            if session.closed or loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=10)
+            else:
+                loop.run_until_complete(session.close())
+
+
+# ---- Process-wide pool used by retry_helpers (None = openai's default per-call sessions)
+_pool: Optional[HttpPool] = None
+
+
+def configure_http_pool(enabled: bool = True, **kwargs) -> Optional[HttpPool]:
+    """
+    Enables pooled keep-alive connections for all chat-completion calls; kwargs
+    (limit, limit_per_host, keepalive_timeout) go to HttpPool.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+    _pool = HttpPool(**kwargs) if enabled else None
+    return _pool
+
+
+def get_http_pool() -> Optional[HttpPool]:
+    return _pool
+
+
+def http_pool_stats() -> Optional[dict]:
+    return _pool.stats() if _pool is not None else None
+
+
+@contextmanager
+def pooled_session():
+    """
+    Routes openai.ChatCompletion.acreate calls made inside the block through the
+    pooled session of the running loop. Yields a dict that receives the response
+    headers of those calls (stays empty without a pool).
+    """
+    headers = {}
+    if _pool is None:
+        yield headers
+        return
+    session_token = openai.aiosession.set(_pool.session())
+    headers_token = _response_headers.set(headers)
+    try:
+        yield headers
+    finally:
+        _response_headers.reset(headers_token)
+        openai.aiosession.reset(session_token)
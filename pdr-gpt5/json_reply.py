@@ -0,0 +1,46 @@
+import json
+import re
+from typing import Any, List, Optional
+
+_FENCE_OPEN = re.compile(r"^```[a-zA-Z0-9_+-]*\n")
+_FENCE_CLOSE = re.compile(r"\n```$")
+
+
+def parse_json_reply(raw: Optional[str]) -> Optional[Any]:
+    """
+    The JSON value in a model reply, or None. Accepts a bare JSON reply, one wrapped in a
+    ``` code fence, or a JSON object embedded in surrounding prose (first one that parses).
+    """
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    if raw.startswith("```"):
+        raw = _FENCE_CLOSE.sub("", _FENCE_OPEN.sub("", raw)).strip()
+    try:
+        return json.loads(raw)
+    except ValueError:
+        pass
+    decoder = json.JSONDecoder()
+    start = raw.find("{")
+    while start != -1:
+        try:
+            return decoder.raw_decode(raw, start)[0]
+        except ValueError:
+            start = raw.find("{", start + 1)
+    return None
+
+
+def clip_text(value: Any, max_chars: int) -> str:
+    """`value` as a single-line string of at most max_chars characters."""
+    text = " ".join(str(value or "").split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+
+def clip_list(value: Any, max_items: int, max_chars: int) -> List[str]:
+    """A reply field that should be a list of short strings, bounded in size."""
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    items = [clip_text(v, max_chars) for v in value]
+    return [item for item in items if item][:max_items]
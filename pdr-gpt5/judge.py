@@ -0,0 +1,221 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from async_runner import run_sync
+from budget_learner import answering_model, completion_tokens, first_attempt_budget, get_budget_learner
+from circuit_breaker import CircuitOpenError
+from critic import LLMCritic
+from json_reply import clip_text, parse_json_reply
+from retry_helpers import achat_with_circuit_fallback, achat_with_retries
+
+
+class FusedJudge(LLMCritic):
+    """
+    Single-call judge for a PDR iteration. One structured reply holds, for all k outputs:
+      - a ranking (best first)
+      - a short rubric analysis per output
+      - strengths / weaknesses / fix_next per output (what the critic report is used for)
+    This replaces the separate Evaluator analysis calls and the LLMCritic call, which
+    read every candidate twice. Per-output entries have the critic report's fields and
+    bounds (see LLMCritic) plus an analysis of at most MAX_ANALYSIS_CHARS.
+    """
+
+    MAX_ANALYSIS_CHARS = 400
+
+    def judge_outputs(self, outputs: List[str], instructions: str,
+                      evaluations: Optional[List[dict]] = None, **kwargs) -> dict:
+        """
+        Blocking wrapper around ajudge_outputs (same keyword arguments).
+        """
+        return run_sync(self.ajudge_outputs(outputs, instructions, evaluations, **kwargs))
+
+    def _messages(self, outputs: List[str], instructions: str, evaluations: Optional[List[dict]]):
+        checks = ""
+        if evaluations:
+            lines = []
+            for i, ev in enumerate(evaluations):
+                line = f"Output #{i + 1}: rule-based score {ev.get('score')}/100"
+                problems = list(ev.get("check_failures") or [])
+                if ev.get("missing_keywords"):
+                    problems.append("missing keywords: " + ", ".join(ev["missing_keywords"]))
+                if not ev.get("word_count_ok", True):
+                    problems.append("word count out of range")
+                lines.append(line + (" (" + "; ".join(problems) + ")" if problems else ""))
+            checks = "Rule-based check results:\n" + "\n".join(lines) + "\n\n"
+        schema = (
+            '{"ranking": [output numbers, best first], '
+            '"outputs": {"1": {"analysis": "<= 60 words, how well it meets each rubric point", '
+            '"strengths": ["<= 3 short items"], "weaknesses": ["<= 3 short items"], '
+            '"fix_next": ["<= 3 concrete changes for the next version"]}, ...}}'
+        )
+        return [
+            {
+                "role": "system",
+                "content": (
+                    "You are a strict, objective judge of multiple candidate outputs. "
+                    "Return ONLY one compact JSON object. No markdown, no code fences, no extra text."
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"Rubric:\n{instructions}\n\n{checks}"
+                    f"Rank all {len(outputs)} outputs against the rubric and review each one. "
+                    f"Reply with JSON of the form:\n{schema}\n\n"
+                    + self._format_outputs(outputs)
+                ),
+            },
+        ]
+
+    def _parse(self, content: str, k: int) -> Optional[dict]:
+        obj = parse_json_reply(content)
+        if not isinstance(obj, dict):
+            return None
+        entries = obj.get("outputs")
+        if isinstance(entries, list):
+            entries = {str(i + 1): e for i, e in enumerate(entries)}
+        if not isinstance(entries, dict):
+            entries = {}
+        ranking = []
+        for value in obj.get("ranking") or []:
+            try:
+                idx = int(value) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= idx < k and idx not in ranking:
+                ranking.append(idx)
+        if not ranking and not entries:
+            return None
+        ranking += [i for i in range(k) if i not in ranking]  # unranked outputs go last
+
+        candidates = []
+        for i, entry in self._entries(entries, k).items():
+            raw = entries.get(str(i + 1))
+            analysis = raw.get("analysis") if isinstance(raw, dict) else raw
+            candidates.append({"analysis": clip_text(analysis, self.MAX_ANALYSIS_CHARS), **entry})
+        return {"ranking": ranking, "candidates": candidates}
+
+    async def ajudge_outputs(
+        self,
+        outputs: List[str],
+        instructions: str,
+        evaluations: Optional[List[dict]] = None,  # rule-based results, shown to the judge
+        *,
+        max_tokens: int = 1500,
+        max_retries: int = 1,               # content-based retry (unparsable reply)
+        network_attempts: int = 6,          # 5xx/429/network retries
+        request_timeout: int = 90,          # seconds
+        allow_model_fallback: bool = True,
+        fallback_models: Tuple[str, ...] = ("gpt-4o",),
+        debug: bool = False,
+        cache_bypass: bool = False,
+        budget_key: Optional[str] = None,   # e.g. task name: learn the first-attempt max_tokens
+    ) -> dict:
+        """
+        Returns {"ranking": [0-based indices, best first], "candidates": [{"analysis",
+        "strengths", "weaknesses", "fix_next", "notes"} per output]}. Retries once with a
+        stricter JSON-only nudge and a bigger budget if the reply does not parse, then asks
+        the fallback models; a reply that never parses degrades to the identity ranking
+        with its excerpt in every candidate's "notes".
+        """
+        messages = self._messages(outputs, instructions, evaluations)
+        if budget_key is not None:
+            budget_key = f"judge/{budget_key}"  # needs differ per caller role
+        learner = get_budget_learner() if budget_key is not None else None
+        budget = first_attempt_budget(self.model, budget_key, max_tokens)
+        fallbacks = fallback_models if allow_model_fallback else ()
+
+        k = len(outputs)
+        finish_reason, replies = None, []
+        for attempt in range(1 + max(0, max_retries)):
+            if attempt:
+                messages = [
+                    {"role": "system", "content": "Return ONLY valid JSON in the requested form. No other text."},
+                    *messages,
+                ]
+                budget = max(3000, int(max_tokens * 2))
+            kwargs = self._make_kwargs(messages=messages, max_comp_tokens=budget, verbosity="low")
+            try:
+                resp = await achat_with_circuit_fallback(
+                    kwargs, fallbacks, reroute=self._route_kwargs, max_attempts=network_attempts,
+                    request_timeout=request_timeout, cache_bypass=cache_bypass,
+                )
+            except Exception as e:
+                raise RuntimeError(f"Error calling {self.model} API: {e}") from e
+            if debug:
+                print(f"JUDGE REQUEST {attempt + 1}:", {k: v for k, v in kwargs.items() if k != "messages"})
+                print(f"JUDGE RESPONSE {attempt + 1}:", resp)
+
+            content, finish_reason, _ = self._extract(resp)
+            judgement = self._parse(content, k)
+            if learner is not None:
+                if attempt == 0:
+                    learner.record(answering_model(resp, self.model), budget_key, budget, completion_tokens(resp),
+                                   truncated=finish_reason == "length" or not content)
+                elif finish_reason != "length":
+                    learner.record_need(answering_model(resp, self.model), budget_key, completion_tokens(resp))
+            if judgement is not None:
+                return judgement
+            replies.append(content)
+
+        # Still unparsable: ask the fallback models directly (as LLMCritic does)
+        for fb_model in [m for m in fallbacks if m != self.model]:
+            kwargs_fb = self._make_kwargs(messages=messages, max_comp_tokens=budget, verbosity=None, model=fb_model)
+            try:
+                resp_fb = await achat_with_retries(
+                    max_attempts=network_attempts, request_timeout=request_timeout,
+                    cache_bypass=cache_bypass, **kwargs_fb
+                )
+            except CircuitOpenError:
+                continue  # this fallback is degraded too; try the next one
+            if debug:
+                print(f"JUDGE FALLBACK {fb_model} RESPONSE:", resp_fb)
+            content_fb, _, _ = self._extract(resp_fb)
+            judgement = self._parse(content_fb, k)
+            if judgement is not None:
+                return judgement
+            replies.append(content_fb)
+
+        # Degrade rather than fail the iteration: identity ranking, excerpt of a reply in notes
+        content = next((reply for reply in reversed(replies) if reply), "")
+        if content:
+            report = self._unstructured_report(content, k)
+            return {"ranking": list(range(k)), "candidates": [{"analysis": "", **report[i]} for i in range(k)]}
+        raise RuntimeError(
+            f"Empty judge completion from {self.model} after retry. "
+            f"finish_reason={finish_reason}, max_completion_tokens={budget}"
+        )
+
+    @staticmethod
+    def select(judgement: dict, scores: List[float]) -> int:
+        """
+        Index of the chosen output: highest rule-based score, ties broken by the judge's ranking.
+        """
+        best = max(scores)
+        rank = {idx: pos for pos, idx in enumerate(judgement["ranking"])}
+        return min((i for i, s in enumerate(scores) if s == best), key=lambda i: rank.get(i, len(scores)))
+
+
+def parity_report(rows: Iterable[Dict[str, Any]]) -> dict:
+    """
+    Compares the fused judge's selections with the two-stage path (best rule-based score,
+    first on ties) over PDRSimulatorCritic result rows (their "judge_selections" column).
+    """
+    iterations = agree = 0
+    per_task: Dict[str, List[int]] = {}
+    for row in rows:
+        selections = row.get("judge_selections")
+        if isinstance(selections, str):
+            selections = json.loads(selections) if selections else []
+        for two_stage, fused in selections or []:
+            iterations += 1
+            agree += int(two_stage == fused)
+            stats = per_task.setdefault(row.get("task_name", ""), [0, 0])
+            stats[0] += 1
+            stats[1] += int(two_stage == fused)
+    return {
+        "iterations": iterations,
+        "agreements": agree,
+        "agreement_rate": agree / iterations if iterations else None,
+        "per_task": {task: {"iterations": n, "agreement_rate": a / n} for task, (n, a) in per_task.items()},
+    }
@@ -10,54 +10,15 @@ from adhoc_simulator import AdHocSimulator
 from pdr_simulator_non_critic import PDRSimulatorNonCritic
 from pdr_simulator_critic import PDRSimulatorCritic
 from critic import LLMCritic
+from judge import FusedJudge
 from expert_evaluator import ExpertEvaluator  
 from analysis import ExperimentAnalyzer
-
-from pathlib import Path
-
-def append_dicts_to_csv(rows, filepath):
-    """
-    Append one or more dict rows to a CSV.
-    - Creates the file (and parent folder) if missing.
-    - Writes header once (on first creation).
-    - Uses existing header thereafter; extra keys are ignored; missing keys become empty cells.
-    """
-    if not rows:
-        return
-
-    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
-
-    file_exists = os.path.exists(filepath) and os.path.getsize(filepath) > 0
-    header = None
-
-    if file_exists:
-        # Read existing header to preserve column order
-        with open(filepath, "r", newline="", encoding="utf-8") as rf:
-            reader = csv.reader(rf)
-            header = next(reader, None)
-            if not header:
-                file_exists = False  # treat as new file if header missing
-
-    if not file_exists:
-        # First write: compute header from provided rows (first-seen key order)
-        seen = set()
-        header = []
-        for r in rows:
-            for k in r.keys():
-                if k not in seen:
-                    seen.add(k)
-                    header.append(k)
-        with open(filepath, "w", newline="", encoding="utf-8") as wf:
-            writer = csv.DictWriter(wf, fieldnames=header, extrasaction="ignore")
-            writer.writeheader()
-            writer.writerows(rows)
-        return
-
-    # Append using existing header
-    with open(filepath, "a", newline="", encoding="utf-8") as af:
-        writer = csv.DictWriter(af, fieldnames=header, extrasaction="ignore")
-        for r in rows:
-            writer.writerow(r)
+from results_io import append_dicts_to_csv
+from scheduler import ExperimentScheduler, build_jobs
+from cassette import Cassette
+from http_pool import configure_http_pool
+from budget_learner import configure_budget_learner
+from pytest_sandbox import configure_sandbox
 
 def save_results_to_csv(results, filename):
     """
@@ -77,6 +38,175 @@ def save_results_to_csv(results, filename):
 
     print(f"Results saved to {filename}.")
 
+# Software-development personas used for the GPT-5 / GPT-4o grid runs
+PERSONAS = [
+    ("Participant_A",
+     "You are a senior backend engineer. You write highly structured, "
+     "maintainable code with thorough test coverage. You always focus on "
+     "edge cases and correctness but sometimes sacrifice brevity."),
+    ("Participant_B",
+     "You are a junior developer. You over-explain in comments, mix styles, "
+     "and sometimes miss required technical keywords, but your enthusiasm "
+     "leads to creative trial-and-error approaches."),
+    ("Participant_C",
+     "You are a software architect and educator. You emphasize clarity, "
+     "clean separation of concerns, and design principles like SRP. "
+     "Your outputs are explanatory and well-structured, sometimes verbose."),
+    ("Participant_D",
+     "You are an open-source contributor and AI enthusiast. You like to "
+     "experiment with speculative or futuristic approaches. Your solutions "
+     "often include imaginative extensions that may not strictly meet rubric requirements."),
+    ("Participant_E",
+     "You are a documentation-focused developer. You write detailed commit "
+     "messages, API docs, and bug reports with a polished narrative style. "
+     "Your code explanations are clear but sometimes too wordy."),
+    ("Participant_F",
+     "You are a QA engineer. You prioritize correctness, validation, and "
+     "complete coverage. You often critique missing cases and ambiguous "
+     "statements, but sometimes your outputs are overly strict and rigid."),
+    ("Participant_G",
+     "You are a DevOps/SRE engineer. You focus on automation, deployment, "
+     "and monitoring concerns. You often emphasize scalability and resilience, "
+     "but may overlook low-level implementation details."),
+    ("Participant_H",
+     "You are a product manager with technical writing skills. You frame "
+     "outputs around end-user value, business impact, and clarity. Your "
+     "summaries are persuasive but may lack detailed technical depth."),
+]
+
+def run_experiment_grid(
+    models=("gpt-4o", "gpt-5"),
+    methods=("adhoc", "pdr", "pdr_critic"),
+    results_dir="results",
+    max_workers=8,
+    model_concurrency=None,
+    max_inflight_requests=32,
+    model_inflight_requests=None,
+    adaptive_inflight=False,
+    resume_timestamp=None,
+    cassette_path=None,
+    cassette_mode="record",
+    http_pool=True,
+    racing=False,
+    stream=False,
+    batch_generation=False,
+    prompt_layout="single",
+    history_blocks=None,
+    prompt_token_budget=None,
+    learn_token_budgets=False,
+    sandbox_tests=False,
+    judge_mode="two_stage",
+):
+    """
+    Runs the full (participant x task x method x model) grid concurrently.
+    Rows stream into results/{method}_{model}_results_{timestamp}.csv as jobs finish.
+    Tune model_concurrency / model_inflight_requests per model, e.g. {"gpt-5": 4, "gpt-4o": 12},
+    or set adaptive_inflight=True to let the per-model request caps follow 429/5xx feedback.
+    To continue a crashed run, pass its timestamp as resume_timestamp: the same files are
+    reused and only the jobs missing from them are scheduled.
+    With cassette_path, every LLM call is recorded to (cassette_mode="record") or served
+    from (cassette_mode="replay", no network / API key needed) that cassette file.
+    http_pool=True keeps connections alive across calls (pool sized to max_inflight_requests);
+    connection reuse is reported under "http_pool" in the returned summary.
+    racing=True lets the PDR methods stop an iteration at the first candidate that passes.
+    stream=True streams participant generations and aborts answers far over the word limit.
+    batch_generation=True makes the PDR methods request all candidates in one n=k call.
+    prompt_layout="conversation" sends persona + task spec as a stable prefix with feedback as
+    follow-up turns; rows report prompt_tokens_total and cached_prompt_tokens either way.
+    history_blocks / prompt_token_budget bound the refinement prompt (feedback blocks kept
+    verbatim / token cap, see prompt_history.PromptHistory); None keeps it unbounded.
+    learn_token_budgets=True learns first-attempt max_tokens per (model, task) in
+    {results_dir}/token_budgets.json (kept across runs); the achieved truncation-retry rate
+    is reported under "token_budgets".
+    sandbox_tests=True executes generated pytest modules against the task's reference
+    implementation in a warm, resource-limited process pool (see pytest_sandbox); pass/fail
+    counts feed the score and are summarised under "sandbox".
+    judge_mode="fused" reviews each pdr_critic iteration with one FusedJudge call (ranking,
+    per-candidate analysis, fix_next) instead of the critic report; "parity" runs both and
+    records the judge's picks (summarise with judge.parity_report over the result rows).
+    """
+    participants = [Participant(name=name, persona_description=desc) for name, desc in PERSONAS]
+    tasks = get_all_tasks()
+
+    evaluator = Evaluator(use_gpt5_for_eval=True, model="gpt-4o")
+    expert_evaluator = ExpertEvaluator(model="gpt-4o", temperature=0)
+    simulators = {
+        "adhoc": AdHocSimulator(
+            evaluator=evaluator,
+            max_iterations=5,
+            score_threshold=85,
+            expert_evaluator=expert_evaluator,
+            stream=stream,
+            prompt_layout=prompt_layout,
+            history_blocks=history_blocks,
+            prompt_token_budget=prompt_token_budget
+        ),
+        "pdr": PDRSimulatorNonCritic(
+            evaluator=evaluator,
+            max_iterations=5,
+            score_threshold=85,
+            num_outputs_per_iter=3,
+            max_workers=None,
+            racing=racing,
+            stream=stream,
+            batch_generation=batch_generation,
+            prompt_layout=prompt_layout,
+            history_blocks=history_blocks,
+            prompt_token_budget=prompt_token_budget
+        ),
+        "pdr_critic": PDRSimulatorCritic(
+            evaluator=evaluator,
+            max_iterations=5,
+            score_threshold=85,
+            num_outputs_per_iter=3,
+            critic=LLMCritic(model="gpt-4o"),
+            max_workers=None,
+            racing=racing,
+            stream=stream,
+            batch_generation=batch_generation,
+            prompt_layout=prompt_layout,
+            history_blocks=history_blocks,
+            prompt_token_budget=prompt_token_budget,
+            judge=FusedJudge(model="gpt-4o"),
+            judge_mode=judge_mode
+        ),
+    }
+
+    # One timestamp per run so all appends go to the same files
+    timestamp = resume_timestamp if resume_timestamp is not None else int(time.time())
+    results_path = os.path.join(results_dir, f"{{method}}_{{model}}_results_{timestamp}.csv")
+
+    scheduler = ExperimentScheduler(
+        simulators=simulators,
+        results_path=results_path,
+        max_workers=max_workers,
+        model_concurrency=model_concurrency,
+        max_inflight_requests=max_inflight_requests,
+        model_inflight_requests=model_inflight_requests,
+        adaptive_inflight=adaptive_inflight,
+    )
+    jobs = build_jobs(participants, tasks, methods, models)
+    learner = None
+    if learn_token_budgets:
+        learner = configure_budget_learner(path=os.path.join(results_dir, "token_budgets.json"))
+    sandbox = configure_sandbox() if sandbox_tests else None
+    pool = None
+    if http_pool:
+        pool_size = max_inflight_requests or 100
+        pool = configure_http_pool(limit=pool_size, limit_per_host=pool_size)
+    try:
+        if cassette_path is None:
+            return scheduler.run(jobs, resume=resume_timestamp is not None)
+        with Cassette(cassette_path, mode=cassette_mode):
+            return scheduler.run(jobs, resume=resume_timestamp is not None)
+    finally:
+        if pool is not None:
+            configure_http_pool(enabled=False)
+        if learner is not None:
+            learner.save()
+        if sandbox is not None:
+            configure_sandbox(enabled=False)
+
 def main():
     
     dir = os.path.dirname(__file__)
@@ -266,6 +396,10 @@ def main():
 
 
 
+    # Concurrent alternative to the sequential loops above:
+    # run_experiment_grid(models=("gpt-4o", "gpt-5"), max_workers=8,
+    #                     model_inflight_requests={"gpt-5": 8, "gpt-4o": 24})
+
     # -------------------------------------------------------------------------
     # ANALYSIS (Descriptive & Inferential)
     # -------------------------------------------------------------------------
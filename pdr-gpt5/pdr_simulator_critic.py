@@ -1,3 +1,4 @@
+import asyncio
 import time
 import random
 import math
@@ -6,6 +7,11 @@ from typing import List, Optional, Dict, Any
 
 from measures import ObjectiveMeasures, SubjectiveMeasures, ExpertEvaluation  # if you want expert eval parity
 from critic import LLMCritic
+from judge import FusedJudge
+from pipeline import Pipeline, Stage
+from async_runner import run_sync
+from telemetry import track_run
+from prompt_history import PromptHistory
 
 class PDRSimulatorCritic:
     """
@@ -15,77 +21,146 @@ class PDRSimulatorCritic:
       1) Generate k outputs with lightweight diversity hints (same as Non-Critic).
       2) Evaluate & pick the best by score (same as Non-Critic).
       3) Ask Critic for JSON labels over ALL outputs (strengths/weaknesses/fix_next).
-      4) Refine prompt from evaluator + critic (bounded history).
+      4) Refine prompt from evaluator + the best output's fix_next (bounded history).
+
+    Steps 1-3 run as a pipeline (see _stages): each candidate is evaluated as soon as it
+    is generated, and the critic starts as soon as the last evaluation lands.
+    max_workers bounds how many candidate generations, and separately how many
+    evaluations, run concurrently (1 = sequential, None = all k at once).
+    racing=True stops an iteration as soon as one evaluated candidate reaches
+    score_threshold, cancelling the generations/evaluations still in flight and skipping
+    the critic.
+    stream=True streams generations and aborts those running past the task's max
+    word count by more than abort_margin (see Participant.agenerate_output).
+    batch_generation=True asks for all k candidates in one n=k completion call
+    (Participant.agenerate_outputs); the evaluations then run as before.
+
+    judge_mode selects how step 3 reviews the candidates:
+      - "two_stage": LLMCritic report -- bounded strengths / weaknesses / fix_next / notes
+        per output, keyed by output index (default, the original path)
+      - "fused": one FusedJudge call returns the ranking, each candidate's rubric analysis
+        and its fix_next items; ties on score are broken by the judge's ranking and the
+        chosen candidate's review drives the refinement
+      - "parity": runs both, keeps the two-stage behaviour, and records the judge's picks
+    Rows report the (two-stage, fused) selection per iteration in "judge_selections";
+    judge.parity_report summarises agreement over rows.
     """
 
     def __init__(self, evaluator, max_iterations=5, score_threshold=85,
-                 num_outputs_per_iter=3, critic=None):
+                 num_outputs_per_iter=3, critic=None, max_workers=1, racing=False,
+                 stream=False, abort_margin=0.2, batch_generation=False,
+                 history_blocks=None, prompt_token_budget=None, prompt_layout="single",
+                 judge=None, judge_mode="two_stage"):
+        if judge_mode not in ("two_stage", "fused", "parity"):
+            raise ValueError(f"Unknown judge_mode: {judge_mode}")
         # If no critic is provided, create a default one
         self.evaluator = evaluator
         self.max_iterations = max_iterations
         self.score_threshold = score_threshold
         self.num_outputs_per_iter = num_outputs_per_iter
         self.critic = critic if critic else LLMCritic()
+        self.judge_mode = judge_mode
+        self.judge = judge if judge else FusedJudge(model=self.critic.model)
+        self.max_workers = max_workers
+        self.racing = racing
+        self.stream = stream
+        self.abort_margin = abort_margin
+        # Feedback kept verbatim / total prompt budget (see PromptHistory; None = unbounded)
+        self.history_blocks = history_blocks
+        self.prompt_token_budget = prompt_token_budget
+        # "conversation" = stable persona/task-spec prefix + feedback as follow-up turns
+        self.prompt_layout = prompt_layout
+        self.batch_generation = batch_generation
 
 
     def simulate(self, participant, task):
+        return run_sync(self.asimulate(participant, task))
+
+    async def asimulate(self, participant, task):
+        # Call-layer events (circuit trips/recoveries, reroutes, queue wait) are attributed to this run
+        with track_run() as telemetry:
+            result = await self._arun(participant, task)
+        return telemetry.merge_into(result)
+
+    async def _arun(self, participant, task):
         start_time = time.time()
         iteration_count = 0
         final_output = ""
         final_score = 0
 
-        current_prompt = (
-            f"Your task:\n{task.target_spec}\n\n"
-            "Generate multiple distinct outputs.\n"
-            "We'll pick the best, but also have a 'critic' assess each output.\n"
+        history = PromptHistory(
+            (
+                f"Your task:\n{task.target_spec}\n\n"
+                "Generate multiple distinct outputs.\n"
+                "We'll pick the best, but also have a 'critic' assess each output.\n"
+            ),
+            header="[PDR WITH CRITIC REFINEMENT]",
+            footer="Based on these preferences and critic's feedback, please refine future outputs.",
+            keep_last=self.history_blocks,
+            token_budget=self.prompt_token_budget,
+            layout=self.prompt_layout,
         )
+        current_prompt = history.prompt()
+        prompt_tokens = []
+        selections = []  # (two-stage pick, fused-judge pick) per judged iteration
 
         for _ in range(self.max_iterations):
             iteration_count += 1
+            prompt_tokens.append(history.tokens())
 
-            # Step 1: Generate multiple outputs
-            outputs = []
-            for i in range(self.num_outputs_per_iter):
-                out = participant.generate_output(
-                    user_instruction=f"{current_prompt}\n\n(Version #{i+1})"
+            # Steps 1-3: Generate, evaluate each output as it lands, then the critic over all outputs
+            batch = None
+            if self.batch_generation:
+                batch = await participant.agenerate_outputs(
+                    current_prompt, self.num_outputs_per_iter, temperature=0.7, budget_key=task.name
                 )
-                outputs.append(out)
+            run = await Pipeline(
+                self._stages(participant, task, history, batch),
+                stop_when=self._passes if self.racing else None,
+            ).run(
+                range(self.num_outputs_per_iter)
+            )
+            outputs = [c["generate"] for c in run["items"]]
+            review = run.get("review") or {}  # empty when a racing candidate already passed
+            critic_report, judgement = review.get("critic"), review.get("judge")
 
-            # Step 2: Evaluate each output for a numeric score
+            # Pick the best by score
             best_index, best_score, best_eval = -1, -1, None
-            for i, out in enumerate(outputs):
-                eval_results = self.evaluator.evaluate_output(out, task.rubric)
+            for i, c in enumerate(run["items"]):
+                eval_results = c["evaluate"]
                 if eval_results["score"] > best_score:
                     best_score = eval_results["score"]
                     best_eval = eval_results
                     best_index = i
 
+            if judgement is not None:
+                fused_index = self.judge.select(judgement, [c["evaluate"]["score"] for c in run["items"]])
+                selections.append((best_index, fused_index))
+                if self.judge_mode == "fused":
+                    best_index = fused_index
+                    best_eval = run["items"][best_index]["evaluate"]
+
             best_output = outputs[best_index]
             final_output = best_output
             final_score = best_score
 
-            # Step 3: Critic evaluates all outputs for deeper labeling
-            instructions_for_critic = (
-                "Evaluate each output for stylistic alignment, correctness, etc. "
-                "Label strengths/weaknesses. Provide short improvement suggestions."
-            )
-            critic_report = self.critic.critique_outputs(outputs, instructions_for_critic)
-
             # If best output meets threshold, stop
             if best_score >= self.score_threshold:
                 break
 
             # Step 4: Identify preferences from the best output and/or the critic report
+            # Only the chosen candidate's review feeds the refinement
+            if self.judge_mode == "fused":
+                best_review = judgement["candidates"][best_index]
+            else:
+                best_review = critic_report[best_index]
             preference_instructions = self._extract_preferences_with_critic(
-                best_output, best_eval, critic_report
+                best_output, best_eval, best_review
             )
 
             # Step 5: Refine prompt
-            current_prompt += (
-                "\n\n[PDR WITH CRITIC REFINEMENT]\n"
-                f"{preference_instructions}\n"
-                "Based on these preferences and critic's feedback, please refine future outputs."
-            )
+            history.add(preference_instructions)
+            current_prompt = history.prompt()
 
         end_time = time.time()
         total_time_sec = end_time - start_time
@@ -98,13 +173,77 @@ class PDRSimulatorCritic:
             "time_spent_sec": total_time_sec,
             "final_score": final_score,
             "final_output": final_output,
-            "satisfaction_score": satisfaction_score
+            "satisfaction_score": satisfaction_score,
+            # Estimated tokens of the refinement prompt sent in each iteration
+            "prompt_tokens_per_iter": json.dumps(prompt_tokens),
+            "judge_mode": self.judge_mode,
+            "judge_selections": json.dumps(selections),
+            "judge_agreement": (sum(a == b for a, b in selections) / len(selections)) if selections else None,
         }
 
-    def _extract_preferences_with_critic(self, best_output, best_eval, critic_report):
+    def _passes(self, candidate):
+        return candidate["evaluate"]["score"] >= self.score_threshold
+
+    def _stages(self, participant, task, history, batch=None):
+        """
+        Pipeline stages for one iteration: generate candidate i (or take it from the
+        n=k batch), evaluate it, and once every candidate is evaluated, review all outputs
+        with the critic and/or the fused judge (see judge_mode).
+        """
+        async def generate(c):
+            if batch is not None:
+                return batch[c["index"]]
+            return await participant.agenerate_output(
+                user_instruction=history.prompt(f"\n\n(Version #{c['index'] + 1})"),
+                stream=self.stream, rubric=task.rubric, abort_margin=self.abort_margin,
+                budget_key=task.name
+            )
+
+        async def evaluate(c):
+            return await self.evaluator.aevaluate_output(c["generate"], task.compiled_rubric)
+
+        async def critique(outputs):
+            instructions_for_critic = (
+                "Evaluate each output for stylistic alignment, correctness, etc. "
+                "Label strengths/weaknesses. Provide short improvement suggestions."
+            )
+            return await self.critic.acritique_outputs(outputs, instructions_for_critic, budget_key=task.name)
+
+        async def judge(outputs, evaluations):
+            judgement = await self.judge.ajudge_outputs(
+                outputs, task.compiled_rubric.evaluation_instructions, evaluations, budget_key=task.name
+            )
+            if self.judge_mode == "fused":
+                # The judge's per-candidate analysis stands in for the Evaluator's (lazy) one
+                for ev, entry in zip(evaluations, judgement["candidates"]):
+                    if entry["analysis"] and "analysis" not in ev:
+                        ev["analysis"] = entry["analysis"]
+            return judgement
+
+        async def review(candidates):
+            outputs = [c["generate"] for c in candidates]
+            evaluations = [c["evaluate"] for c in candidates]
+            critic_report = judgement = None
+            if self.judge_mode == "two_stage":
+                critic_report = await critique(outputs)
+            elif self.judge_mode == "fused":
+                judgement = await judge(outputs, evaluations)
+            else:
+                critic_report, judgement = await asyncio.gather(critique(outputs), judge(outputs, evaluations))
+            return {"critic": critic_report, "judge": judgement}
+
+        return [
+            Stage("generate", generate, workers=self.max_workers),
+            Stage("evaluate", evaluate, workers=self.max_workers),
+            Stage("review", review, join=True),
+        ]
+
+    def _extract_preferences_with_critic(self, best_output, best_eval, best_review):
         """
         Incorporate the main evaluator's numeric analysis and
         the critic's labels to produce more refined preferences.
+        best_review is the critic (or fused judge) entry for the chosen output; only its
+        fix_next items are used (weaknesses / notes when the critic gave none).
         """
         lines = []
 
@@ -115,14 +254,23 @@ class PDRSimulatorCritic:
             lines.append("Non-preferred: Word count out of range.")
 
         if not best_eval["must_include_ok"]:
-            lines.append("Non-preferred: Missing required keywords.")
-
-        # From the critic:
-        # The critic_report is a single string containing feedback for all outputs.
-        # You might parse it for the best output specifically, but let's keep it simple:
-        # We'll just include a short excerpt from the critic's overall feedback.
-        excerpt = critic_report[:300] + "..." if len(critic_report) > 300 else critic_report
-        lines.append("Critic Summary (excerpt): " + excerpt)
+            missing = best_eval.get("missing_keywords")
+            if missing:
+                lines.append("Non-preferred: Missing required keywords: " + ", ".join(missing) + ".")
+            else:
+                lines.append("Non-preferred: Missing required keywords.")
+        failed = (best_eval.get("check_failures")
+                  or [name for name, ok in best_eval.get("checks", {}).items() if not ok])
+        if failed:
+            lines.append("Non-preferred: Failed format checks: " + "; ".join(failed) + ".")
+
+        # From the critic: what to fix in the chosen output (entries are size-bounded)
+        fixes = best_review.get("fix_next") or best_review.get("weaknesses")
+        if fixes:
+            lines.append("Critic: fix next:")
+            lines.extend(f"- {item}" for item in fixes)
+        elif best_review.get("notes"):
+            lines.append("Critic notes: " + best_review["notes"])
 
         return "\n".join(lines)
 
@@ -1,5 +1,12 @@
+import json
 import time
 
+from async_runner import run_sync
+from evaluator import aensure_analysis
+from telemetry import track_run
+from prompt_history import PromptHistory
+from pipeline import Pipeline, Stage
+
 class PDRSimulatorNonCritic:
     """
     Implements the Preference-Driven Refinement (PDR) approach for a (participant, task) pair.
@@ -8,56 +15,105 @@ class PDRSimulatorNonCritic:
       2. Evaluate & pick best output.
       3. Identify preferred and non-preferred elements (based on evaluation or GPT-4o analysis).
       4. Refine the prompt to embed preferences and avoid non-preferred elements.
+
+    Steps 1-2 run as a pipeline (see _stages): each candidate is evaluated as soon as it
+    is generated, while the remaining candidates are still being produced.
+    max_workers bounds how many candidate generations, and separately how many
+    evaluations, run concurrently (1 = sequential, None = all k at once).
+    racing=True stops an iteration as soon as one evaluated candidate reaches
+    score_threshold, cancelling the generations/evaluations still in flight.
+    stream=True streams generations and aborts those running past the task's max
+    word count by more than abort_margin (see Participant.agenerate_output).
+    batch_generation=True asks for all k candidates in one n=k completion call
+    (Participant.agenerate_outputs); the evaluations then run as before.
     """
 
-    def __init__(self, evaluator, max_iterations=5, score_threshold=85, num_outputs_per_iter=3):
+    def __init__(self, evaluator, max_iterations=5, score_threshold=85, num_outputs_per_iter=3,
+                 max_workers=1, racing=False,
+                 stream=False, abort_margin=0.2, batch_generation=False,
+                 history_blocks=None, prompt_token_budget=None, prompt_layout="single"):
         self.evaluator = evaluator
         self.max_iterations = max_iterations
         self.score_threshold = score_threshold
         self.num_outputs_per_iter = num_outputs_per_iter
+        self.max_workers = max_workers
+        self.racing = racing
+        self.stream = stream
+        self.abort_margin = abort_margin
+        # Feedback kept verbatim / total prompt budget (see PromptHistory; None = unbounded)
+        self.history_blocks = history_blocks
+        self.prompt_token_budget = prompt_token_budget
+        # "conversation" = stable persona/task-spec prefix + feedback as follow-up turns
+        self.prompt_layout = prompt_layout
+        self.batch_generation = batch_generation
 
     def simulate(self, participant, task):
         """
         Runs the PDR simulation for a single participant-task pair.
         Returns a dictionary with iteration count, time spent, final score, etc.
         """
+        return run_sync(self.asimulate(participant, task))
+
+    async def asimulate(self, participant, task):
+        """
+        Async version of simulate(); many (participant, task) runs can share one event loop.
+        """
+        # Call-layer events (circuit trips/recoveries, reroutes, queue wait) are attributed to this run
+        with track_run() as telemetry:
+            result = await self._arun(participant, task)
+        return telemetry.merge_into(result)
 
+    async def _arun(self, participant, task):
         start_time = time.time()
         iteration_count = 0
         final_output = ""
         final_score = 0
 
         # Start with the raw target_spec as the participant's initial prompt
-        current_prompt = (
-            f"Your task:\n{task.target_spec}\n\n"
-            "Generate multiple distinct outputs.\n"
-            "We'll pick the best and refine from there."
+        history = PromptHistory(
+            (
+                f"Your task:\n{task.target_spec}\n\n"
+                "Generate multiple distinct outputs.\n"
+                "We'll pick the best and refine from there."
+            ),
+            header="[PDR REFINEMENT]",
+            footer="Based on these preferences, please refine future outputs.",
+            keep_last=self.history_blocks,
+            token_budget=self.prompt_token_budget,
+            layout=self.prompt_layout,
         )
+        current_prompt = history.prompt()
+        prompt_tokens = []
 
         for _ in range(self.max_iterations):
             iteration_count += 1
+            prompt_tokens.append(history.tokens())
 
-            # Step 1: Generate multiple outputs
-            outputs = []
-            for i in range(self.num_outputs_per_iter):
-                # Slight variation: we can label each request or just re-call
-                output_text = participant.generate_output(
-                    user_instruction=f"{current_prompt}\n\n(Version #{i+1})",
-                    temperature=0.7
+            # Steps 1-2: Generate multiple outputs ("Version #i") and evaluate each one as it lands
+            batch = None
+            if self.batch_generation:
+                batch = await participant.agenerate_outputs(
+                    current_prompt, self.num_outputs_per_iter, temperature=0.7, budget_key=task.name
                 )
-                outputs.append(output_text)
+            run = await Pipeline(
+                self._stages(participant, task, history, batch),
+                stop_when=self._passes if self.racing else None,
+            ).run(
+                range(self.num_outputs_per_iter)
+            )
+            outputs = [c["generate"] for c in run["items"]]
 
-            # Step 2: Evaluate each output & pick the best
+            # Pick the best
             best_index = -1
             best_score = -1
             best_eval = None
-            for i, out in enumerate(outputs):
-                eval_results = self.evaluator.evaluate_output(out, task.rubric)
+            for i, c in enumerate(run["items"]):
+                eval_results = c["evaluate"]
                 if eval_results["score"] > best_score:
                     best_score = eval_results["score"]
                     best_eval = eval_results
                     best_index = i
-            
+
             best_output = outputs[best_index]
             final_output = best_output
             final_score = best_score
@@ -67,16 +123,15 @@ class PDRSimulatorNonCritic:
                 break
 
             # Step 3: Identify preferences from the best output (preferred vs. non-preferred)
+            # Only the best candidate's GPT-4o analysis is ever read (computed lazily here)
+            await aensure_analysis(best_eval)
             preference_instructions = self._extract_preferences(best_output, best_eval)
 
             # Step 4: Refine the prompt with the new preferences
             # We embed a "Preferred Elements" vs. "Non-preferred" section.
             # In a real scenario, these might be bullet points or examples.
-            current_prompt += (
-                "\n\n[PDR REFINEMENT]\n"
-                f"{preference_instructions}\n"
-                "Based on these preferences, please refine future outputs."
-            )
+            history.add(preference_instructions)
+            current_prompt = history.prompt()
 
         end_time = time.time()
         total_time_sec = end_time - start_time
@@ -89,9 +144,37 @@ class PDRSimulatorNonCritic:
             "time_spent_sec": total_time_sec,
             "final_score": final_score,
             "final_output": final_output,
-            "satisfaction_score": satisfaction_score
+            "satisfaction_score": satisfaction_score,
+            # Estimated tokens of the refinement prompt sent in each iteration
+            "prompt_tokens_per_iter": json.dumps(prompt_tokens),
         }
 
+    def _passes(self, candidate):
+        return candidate["evaluate"]["score"] >= self.score_threshold
+
+    def _stages(self, participant, task, history, batch=None):
+        """
+        Pipeline stages for one iteration: generate candidate i (or take it from the
+        n=k batch), then evaluate it.
+        """
+        async def generate(c):
+            if batch is not None:
+                return batch[c["index"]]
+            return await participant.agenerate_output(
+                user_instruction=history.prompt(f"\n\n(Version #{c['index'] + 1})"),
+                temperature=0.7,
+                stream=self.stream, rubric=task.rubric, abort_margin=self.abort_margin,
+                budget_key=task.name
+            )
+
+        async def evaluate(c):
+            return await self.evaluator.aevaluate_output(c["generate"], task.compiled_rubric)
+
+        return [
+            Stage("generate", generate, workers=self.max_workers),
+            Stage("evaluate", evaluate, workers=self.max_workers),
+        ]
+
     def _extract_preferences(self, output_text, eval_results):
         """
         Simple method to derive 'preferred' and 'non-preferred' elements from the best output.
@@ -112,7 +195,16 @@ class PDRSimulatorNonCritic:
 
         # If required keywords are missing, we mark them as non-preferred
         if not eval_results["must_include_ok"]:
-            lines.append("Non-preferred: Missing required keywords or phrases. Add them in next version.")
+            missing = eval_results.get("missing_keywords")
+            if missing:
+                lines.append("Non-preferred: Missing required keywords or phrases: "
+                             + ", ".join(missing) + ". Add them in next version.")
+            else:
+                lines.append("Non-preferred: Missing required keywords or phrases. Add them in next version.")
+        failed = (eval_results.get("check_failures")
+                  or [name for name, ok in eval_results.get("checks", {}).items() if not ok])
+        if failed:
+            lines.append("Non-preferred: Failed format checks: " + "; ".join(failed) + ".")
 
         # We can also incorporate a snippet of GPT-4o analysis
         analysis_text = eval_results.get("analysis", "")
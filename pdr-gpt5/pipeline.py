@@ -0,0 +1,121 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    Per-item stage: `fn(record)` is awaited for every item by up to `workers` concurrent
+    workers (None = one per item) and its result is stored as record[name].
+    Join stage (join=True, must be last): `fn(records)` is awaited once with all records,
+    in item order, as soon as the last one arrives.
+    """
+
+    def __init__(self, name: str, fn: Callable[..., Awaitable], workers: Optional[int] = 1,
+                 join: bool = False):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.join = join
+
+
+class Pipeline:
+    """
+    Small asyncio dataflow engine: items move through the stages over bounded queues,
+    so item i enters stage 2 as soon as stage 1 is done with it, while stage 1 is still
+    working on the other items.
+
+    Each item travels as a record dict {"index": i, "input": item, <stage name>: result, ...}.
+    run() returns {"items": fully processed records in input order, <join stage name>: join result,
+    "stopped_by": record or None}.
+    The first failing stage call cancels the whole run and its exception propagates.
+
+    Racing: with stop_when, the first record that satisfies stop_when(record) after its
+    last per-item stage cancels all work still in flight, skips the join stage, and is
+    returned as "stopped_by".
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: Optional[int] = None,
+                 stop_when: Optional[Callable[[dict], bool]] = None):
+        if any(stage.join for stage in stages[:-1]):
+            raise ValueError("Only the last pipeline stage may be a join stage")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stop_when = stop_when
+
+    async def run(self, items: Iterable[Any]) -> Dict[str, Any]:
+        items = list(items)
+        records = [{"index": i, "input": item} for i, item in enumerate(items)]
+        size = self.queue_size or max(1, len(records))
+        queues = [asyncio.Queue(maxsize=size) for _ in self.stages]
+        out: Dict[str, Any] = {"stopped_by": None}
+        item_stages = [stage for stage in self.stages if not stage.join]
+
+        def worker_count(stage: Stage) -> int:
+            if stage.join:
+                return 1
+            return max(1, len(records) if stage.workers is None else min(stage.workers, len(records)))
+
+        counts = [worker_count(stage) for stage in self.stages]
+        running = list(counts)
+
+        async def close_stage(pos: int):
+            # The last worker of a stage tells every worker of the next stage to stop
+            running[pos] -= 1
+            if running[pos] == 0 and pos + 1 < len(self.stages):
+                for _ in range(counts[pos + 1]):
+                    await queues[pos + 1].put(_DONE)
+
+        async def feed():
+            for record in records:
+                await queues[0].put(record)
+            for _ in range(counts[0]):
+                await queues[0].put(_DONE)
+
+        async def work(pos: int):
+            stage = self.stages[pos]
+            while True:
+                record = await queues[pos].get()
+                if record is _DONE:
+                    break
+                record[stage.name] = await stage.fn(record)
+                if pos == len(item_stages) - 1 and self.stop_when is not None and self.stop_when(record):
+                    out["stopped_by"] = record
+                    raise _Stopped()
+                if pos + 1 < len(self.stages):
+                    await queues[pos + 1].put(record)
+            await close_stage(pos)
+
+        async def join(pos: int):
+            stage = self.stages[pos]
+            arrived = []
+            while True:
+                record = await queues[pos].get()
+                if record is _DONE:
+                    break
+                arrived.append(record)
+            arrived.sort(key=lambda r: r["index"])
+            out[stage.name] = await stage.fn(arrived)
+
+        tasks = [asyncio.ensure_future(feed())]
+        for pos, stage in enumerate(self.stages):
+            runner = join if stage.join else work
+            tasks += [asyncio.ensure_future(runner(pos)) for _ in range(counts[pos])]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not isinstance(e, _Stopped):
+                raise
+        last = item_stages[-1].name if item_stages else "input"
+        out["items"] = [record for record in records if last in record]
+        return out
@@ -0,0 +1,141 @@
+from typing import List, Optional, Union
+
+from token_utils import estimate_prompt_tokens, estimate_tokens
+
+
+class PromptHistory:
+    """
+    Iterative-refinement prompt with bounded growth.
+
+    The prompt is the fixed `head` (task spec + instructions) followed by feedback blocks.
+    The last `keep_last` blocks are kept verbatim, rendered exactly as the simulators used
+    to append them (header / body / footer). Older blocks are condensed extractively: their
+    body lines are deduplicated (most recent occurrence wins) and clipped to
+    `max_line_chars`, so the result is deterministic for a given history.
+    If the prompt still exceeds `token_budget`, the oldest condensed lines go first, then
+    the oldest verbatim blocks (the latest block and the head are always kept).
+    The defaults (keep_last=None, token_budget=None) keep every block verbatim: the
+    original ever-growing prompt. Set either to bound it.
+
+    layout="single" renders one user message (the original format). layout="conversation"
+    renders chat turns instead: the head is its own, byte-identical first user turn and each
+    feedback block follows as a separate user turn, so persona + task spec form a stable
+    prefix that provider-side prompt caching can reuse across iterations and candidates.
+    Its turns are append-only: keep_last does not apply, and older blocks are condensed
+    only when token_budget forces it.
+    """
+
+    def __init__(self, head: str, header: str, footer: str, keep_last: Optional[int] = None,
+                 token_budget: Optional[int] = None, max_line_chars: int = 160,
+                 layout: str = "single"):
+        if layout not in ("single", "conversation"):
+            raise ValueError(f"Unknown prompt layout: {layout}")
+        self.layout = layout
+        self.head = head
+        self.header = header
+        self.footer = footer
+        self.keep_last = keep_last
+        self.token_budget = token_budget
+        self.max_line_chars = max_line_chars
+        self.blocks: List[str] = []
+
+    def add(self, body: str):
+        self.blocks.append(body)
+
+    def _block(self, body: str) -> str:
+        return f"\n\n{self.header}\n{body}\n{self.footer}"
+
+    def _condense(self, bodies: List[str]) -> List[str]:
+        lines, seen = [], set()
+        for body in reversed(bodies):
+            for line in reversed(body.splitlines()):
+                line = line.strip()
+                if not line or line in seen:
+                    continue
+                seen.add(line)
+                if len(line) > self.max_line_chars:
+                    line = line[:self.max_line_chars].rstrip() + "..."
+                lines.append(line)
+        lines.reverse()
+        return lines
+
+    @staticmethod
+    def _condensed_text(condensed: List[str]) -> str:
+        return "[EARLIER FEEDBACK, CONDENSED]\n" + "\n".join(f"- {line}" for line in condensed)
+
+    def _compose(self, condensed: List[str], recent: List[str]) -> str:
+        text = self.head
+        if condensed:
+            text += "\n\n" + self._condensed_text(condensed)
+        return text + "".join(self._block(body) for body in recent)
+
+    def _select(self, keep_last: Optional[int]):
+        """
+        (condensed lines, verbatim blocks) that fit the token budget.
+        """
+        if keep_last is None:
+            older, recent = [], list(self.blocks)
+        else:
+            split = max(0, len(self.blocks) - keep_last)
+            older, recent = self.blocks[:split], self.blocks[split:]
+        condensed = self._condense(older)
+        if self.token_budget is None:
+            return condensed, recent
+        while (estimate_tokens(self._compose(condensed, recent)) > self.token_budget
+               and (condensed or len(recent) > 1)):
+            if condensed:
+                condensed = condensed[1:]
+            else:
+                recent = recent[1:]
+        return condensed, recent
+
+    def _select_turns(self):
+        """
+        Conversation layout: every block stays verbatim (append-only, so earlier turns are
+        a stable prefix) until the token budget is exceeded; then the oldest blocks are
+        condensed one at a time, and only then are condensed lines dropped.
+        """
+        if self.token_budget is None:
+            return [], list(self.blocks)
+        for split in range(len(self.blocks)):
+            condensed = self._condense(self.blocks[:split])
+            recent = self.blocks[split:]
+            if estimate_prompt_tokens(self._turns(condensed, recent)) <= self.token_budget:
+                return condensed, recent
+        return self._select(1)
+
+    def render(self) -> str:
+        return self._compose(*self._select(self.keep_last))
+
+    def _turns(self, condensed: List[str], recent: List[str]) -> List[dict]:
+        turns = [{"role": "user", "content": self.head}]
+        if condensed:
+            turns.append({"role": "user", "content": self._condensed_text(condensed)})
+        for body in recent:
+            turns.append({"role": "user", "content": f"{self.header}\n{body}\n{self.footer}"})
+        return turns
+
+    def turns(self) -> List[dict]:
+        return self._turns(*self._select_turns())
+
+    def prompt(self, suffix: str = "") -> Union[str, List[dict]]:
+        """
+        What to pass as Participant user_instruction: a string (single layout) or the
+        list of user turns (conversation layout). `suffix` goes at the end of the prompt;
+        in the conversation layout it is a trailing turn of its own, so the turns before it
+        stay byte-identical across candidates.
+        """
+        if self.layout == "single":
+            return self.render() + suffix
+        turns = self.turns()
+        if suffix.strip():
+            turns.append({"role": "user", "content": suffix.strip()})
+        return turns
+
+    def tokens(self) -> int:
+        if self.layout == "single":
+            return estimate_tokens(self.render())
+        return estimate_prompt_tokens(self.turns())
+
+    def __str__(self) -> str:
+        return self.render()
@@ -0,0 +1,378 @@
+import ast
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from concurrency import ConcurrencyLimit
+
+REFERENCE_MODULE = "reference_impl"
+TEST_FILE = "test_candidate.py"
+
+# Environment variables the workers keep; everything else (API keys, tokens) is dropped
+_SAFE_ENV = ("PATH", "LANG", "LC_ALL", "LC_CTYPE", "TZ", "TMPDIR", "TEMP", "TMP")
+
+
+class _ReferenceImports(ast.NodeTransformer):
+    """
+    Points every way the candidate reaches `function` at the reference module:
+    `from x import function` is retargeted, `x.function` becomes `function`, and a
+    candidate's own top-level stub of `function` is dropped.
+    """
+
+    def __init__(self, function: str):
+        self.function = function
+        self.redirected = set()  # module names whose `.function` was rewritten
+
+    def visit_ImportFrom(self, node):
+        names = [alias for alias in node.names if alias.name == self.function]
+        if not names:
+            return node
+        others = [alias for alias in node.names if alias.name != self.function]
+        ref = ast.ImportFrom(module=REFERENCE_MODULE, names=names, level=0)
+        if not others:
+            return ref
+        node.names = others
+        return [node, ref]
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if node.attr == self.function and isinstance(node.value, ast.Name):
+            self.redirected.add(node.value.id)
+            return ast.copy_location(ast.Name(id=self.function, ctx=node.ctx), node)
+        return node
+
+    def visit_Module(self, node):
+        self.generic_visit(node)
+        node.body = [
+            stmt for stmt in node.body
+            if not (isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)) and stmt.name == self.function)
+        ]
+        # `import x` kept only for x.function would now fail to import x: drop it
+        used = {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+        for stmt in [s for s in node.body if isinstance(s, ast.Import)]:
+            stmt.names = [
+                alias for alias in stmt.names
+                if (alias.asname or alias.name.split(".")[0]) not in self.redirected - used
+            ]
+        node.body = [stmt for stmt in node.body if not (isinstance(stmt, ast.Import) and not stmt.names)]
+        node.body.insert(0, ast.ImportFrom(
+            module=REFERENCE_MODULE, names=[ast.alias(name=self.function)], level=0))
+        return node
+
+
+def rewrite_imports(code: str, function: str) -> Optional[str]:
+    """
+    The candidate test module rewritten to test the reference `function`
+    (None when the code does not parse).
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    return ast.unparse(ast.fix_missing_locations(_ReferenceImports(function).visit(tree)))
+
+
+# ---- Worker side (runs in the pool's warm interpreters)
+
+def _blocked(*args, **kwargs):
+    raise OSError("network access is disabled in the test workers")
+
+
+def _init_worker(memory_mb: Optional[int]):
+    import resource
+
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # Best-effort, in-process only: Python-level socket connects / DNS lookups fail, but
+    # subprocesses, os.system and ctypes are not restricted (see PytestSandbox)
+    socket.socket.connect = _blocked
+    socket.socket.connect_ex = _blocked
+    socket.create_connection = _blocked
+    socket.getaddrinfo = _blocked
+    # Candidate code never sees the parent's secrets
+    for name in [n for n in os.environ if n not in _SAFE_ENV]:
+        del os.environ[name]
+    os.environ["PYTEST_DISABLE_PLUGIN_AUTOLOAD"] = "1"
+    import pytest  # noqa: F401  (warm import, paid once per worker)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class _Counter:
+    """pytest plugin collecting per-run outcome counts."""
+
+    def __init__(self):
+        self.collected = self.passed = self.failed = self.errors = self.skipped = 0
+        self.failed_tests = []
+
+    def pytest_collection_modifyitems(self, items):
+        self.collected = len(items)
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.errors += 1
+
+    def pytest_runtest_logreport(self, report):
+        name = report.nodeid.split("::")[-1]
+        if report.when == "call":
+            if report.passed:
+                self.passed += 1
+            elif report.skipped:
+                self.skipped += 1
+            else:
+                self.failed += 1
+                self.failed_tests.append(name)
+        elif report.failed:
+            self.errors += 1
+            self.failed_tests.append(name)
+        elif report.skipped and report.when == "setup":
+            self.skipped += 1
+
+
+def _run_in_worker(files: dict, timeout_sec: float, cpu_sec: Optional[float]) -> dict:
+    import resource
+
+    import pytest
+
+    started = time.monotonic()
+    workdir = tempfile.mkdtemp(prefix="pdr-pytest-")
+    counter = _Counter()
+    limits = {"hit": None}
+
+    def interrupt(kind):
+        def handler(signum, frame):
+            limits["hit"] = kind
+            raise KeyboardInterrupt()  # pytest stops the session and returns
+        return handler
+
+    old_alarm = signal.signal(signal.SIGALRM, interrupt("timeout"))
+    old_xcpu = signal.signal(signal.SIGXCPU, interrupt("cpu"))
+    old_cpu = resource.getrlimit(resource.RLIMIT_CPU)
+    old_cwd = os.getcwd()
+    try:
+        for name, source in files.items():
+            with open(os.path.join(workdir, name), "w", encoding="utf-8") as f:
+                f.write(source)
+        if cpu_sec:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = int(usage.ru_utime + usage.ru_stime + cpu_sec) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, old_cpu[1]))
+        signal.setitimer(signal.ITIMER_REAL, timeout_sec)
+        os.chdir(workdir)  # relative paths written by the tests land in the run's temp dir
+        sys.path.insert(0, workdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                exit_code = pytest.main(
+                    [os.path.join(workdir, TEST_FILE), "-q", "-p", "no:cacheprovider", "--capture=sys"],
+                    plugins=[counter],
+                )
+        except KeyboardInterrupt:  # a limit fired outside pytest's own handling
+            exit_code = pytest.ExitCode.INTERRUPTED
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_alarm)
+        signal.signal(signal.SIGXCPU, old_xcpu)
+        resource.setrlimit(resource.RLIMIT_CPU, old_cpu)
+        os.chdir(old_cwd)
+        if workdir in sys.path:
+            sys.path.remove(workdir)
+        # Forget this run's modules so the next candidate imports its own files
+        for name, module in list(sys.modules.items()):
+            if (getattr(module, "__file__", None) or "").startswith(workdir):
+                del sys.modules[name]
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "exit_code": int(exit_code),
+        "collected": counter.collected,
+        "passed": counter.passed,
+        "failed": counter.failed,
+        "errors": counter.errors,
+        "skipped": counter.skipped,
+        "failed_tests": counter.failed_tests[:10],
+        "limit_hit": limits["hit"],
+        "duration_sec": time.monotonic() - started,
+    }
+
+
+# ---- Parent side
+
+class PytestSandbox:
+    """
+    Runs generated pytest modules against a reference implementation in a pool of warm
+    worker interpreters (spawned once, pytest pre-imported), so a run costs one in-process
+    pytest.main call rather than an interpreter start.
+
+    Each run gets a fresh temp dir (also its working directory) holding the candidate
+    module (imports rewritten to the reference) and the reference module. Limits per run:
+    `timeout_sec` wall clock and `cpu_sec` CPU time (both end the pytest session early),
+    `memory_mb` address space per worker, and no inherited environment beyond _SAFE_ENV.
+
+    This is resource limiting, not a security boundary: the workers run as the current
+    user with its filesystem access, and the network block only patches Python's socket
+    module (subprocess, os.system or ctypes get around it). Only run it on generated
+    tests you would run locally anyway, or inside a container / VM that provides isolation.
+
+    At most `workers` runs are submitted at a time, so a run never waits in the pool's
+    queue and the hang deadline (timeout_sec + 5s) only measures execution. A worker that
+    dies or hangs past that deadline is replaced by restarting the pool; runs caught in a
+    restart they did not cause are resubmitted to the fresh pool, so only the run that
+    hung (or crashes the pool twice) is charged.
+    """
+
+    MAX_SUBMITS = 5  # per run, counting free resubmits after other runs' restarts
+
+    def __init__(self, workers: Optional[int] = None, timeout_sec: float = 10.0, cpu_sec: Optional[float] = 10.0,
+                 memory_mb: Optional[int] = 1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout_sec = timeout_sec
+        self.cpu_sec = cpu_sec
+        self.memory_mb = memory_mb
+        self.runs = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.resubmits = 0
+        self.total_sec = 0.0
+        self._executor = None
+        self._slots = ConcurrencyLimit(self.workers)
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),  # never fork the threaded parent
+                    initializer=_init_worker,
+                    initargs=(self.memory_mb,),
+                )
+            return self._executor
+
+    def _restart(self, broken) -> bool:
+        """
+        Replaces `broken` with a fresh pool; False if another run already replaced it.
+        """
+        with self._lock:
+            if self._executor is not broken:
+                return False
+            self._executor = None
+        # Terminate the workers too: shutdown() alone would wait for a hung one. Queued and
+        # running futures then fail with BrokenProcessPool (never cancelled), and their
+        # callers resubmit them.
+        for process in list((getattr(broken, "_processes", None) or {}).values()):
+            process.terminate()
+        broken.shutdown(wait=False)
+        return True
+
+    def warm(self):
+        """Starts every worker now instead of on the first runs."""
+        pool = self._pool()
+        for future in [pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    async def arun_tests(self, code: str, reference_source: str, function: str) -> Optional[dict]:
+        """
+        Runs the candidate test module `code` against `reference_source`, which defines
+        `function`. Returns outcome counts (collected / passed / failed / errors / skipped,
+        failed_tests, limit_hit, duration_sec), or None when the code does not parse.
+        """
+        test_source = rewrite_imports(code, function)
+        if test_source is None:
+            return None
+        files = {TEST_FILE: test_source, f"{REFERENCE_MODULE}.py": reference_source}
+        async with self._slots.slot():
+            result = await self._arun(files)
+        with self._lock:
+            self.runs += 1
+            self.total_sec += result["duration_sec"]
+            if result["limit_hit"] in ("timeout", "cpu"):
+                self.timeouts += 1
+            elif result["limit_hit"] == "crash":
+                self.crashes += 1
+        return result
+
+    async def _arun(self, files: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        limit_hit, caused = "crash", 0
+        for _ in range(self.MAX_SUBMITS):
+            pool = self._pool()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(pool, _run_in_worker, files, self.timeout_sec, self.cpu_sec),
+                    timeout=self.timeout_sec + 5.0,
+                )
+            except asyncio.TimeoutError:
+                self._restart(pool)
+                limit_hit = "timeout"
+                break
+            except BrokenProcessPool:
+                # The first run to see a broken pool restarts it (and may be the culprit:
+                # charged on the second time); later ones were collateral and resubmit freely
+                if self._restart(pool):
+                    caused += 1
+                    if caused > 1:
+                        break
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # the caller was cancelled
+                # Only the pool cancelled this run: resubmit
+            with self._lock:
+                self.resubmits += 1
+        return {"exit_code": None, "collected": 0, "passed": 0, "failed": 0, "errors": 1, "skipped": 0,
+                "failed_tests": [], "limit_hit": limit_hit, "duration_sec": time.monotonic() - started}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes,
+                "resubmits": self.resubmits,
+                "mean_run_sec": self.total_sec / self.runs if self.runs else None,
+            }
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# ---- Process-wide sandbox used by the Evaluator (None = generated tests are not executed)
+_sandbox: Optional[PytestSandbox] = None
+
+
+def configure_sandbox(enabled: bool = True, **kwargs) -> Optional[PytestSandbox]:
+    """
+    Enables executing generated tests for rubrics with "execute_tests"; kwargs
+    (workers, timeout_sec, cpu_sec, memory_mb) go to PytestSandbox.
+    """
+    global _sandbox
+    if _sandbox is not None:
+        _sandbox.close()
+    _sandbox = PytestSandbox(**kwargs) if enabled else None
+    return _sandbox
+
+
+def get_sandbox() -> Optional[PytestSandbox]:
+    return _sandbox
+
+
+def sandbox_stats() -> Optional[dict]:
+    return _sandbox.stats() if _sandbox is not None else None
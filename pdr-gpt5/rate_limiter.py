@@ -0,0 +1,224 @@
+import asyncio
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(value) -> Optional[float]:
+    """
+    Seconds from a rate-limit header value: plain seconds ("1.5"), Go-style durations
+    as used by x-ratelimit-reset-* ("20ms", "6m0s", "1h2m3.5s"), or an HTTP date
+    (Retry-After). Returns None if the value cannot be parsed.
+    """
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    if not text:
+        return None
+    try:
+        return max(0.0, float(text))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(text)
+    if parts and "".join(num + unit for num, unit in parts) == text:
+        scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+        return sum(float(num) * scale[unit] for num, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def header_lookup(headers: Optional[Mapping], name: str):
+    """Case-insensitive header lookup that tolerates None / non-dict header containers."""
+    if not headers:
+        return None
+    try:
+        value = headers.get(name)
+        if value is not None:
+            return value
+        for k, v in headers.items():
+            if str(k).lower() == name:
+                return v
+    except Exception:
+        return None
+    return None
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_min`, holding at most `burst_sec`
+    seconds' worth. reserve() always succeeds by going into debt and returns how long
+    the caller must wait before acting, so concurrent callers queue up fairly.
+    """
+
+    def __init__(self, rate_per_min: float, burst_sec: float = 10.0):
+        self.rate_per_sec = rate_per_min / 60.0
+        self.capacity = max(1.0, self.rate_per_sec * burst_sec)
+        self.level = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._last) * self.rate_per_sec)
+        self._last = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill_locked()
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate_per_sec
+
+    def credit(self, amount: float):
+        """Returns (or, if negative, charges) tokens after the fact."""
+        with self._lock:
+            self._refill_locked()
+            self.level = min(self.capacity, self.level + amount)
+
+    def set_level(self, level: float):
+        with self._lock:
+            self._refill_locked()
+            self.level = min(self.capacity, level)
+
+
+class ModelRateLimit:
+    """
+    Requests-per-minute and tokens-per-minute buckets for one model.
+    `headroom` keeps throughput just under the provider quota.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 headroom: float = 0.95, burst_sec: float = 10.0):
+        self.requests = TokenBucket(rpm * headroom, burst_sec) if rpm else None
+        self.tokens = TokenBucket(tpm * headroom, burst_sec) if tpm else None
+        self.waited_sec = 0.0
+        self.calls = 0
+
+    def reserve(self, est_tokens: int) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(est_tokens))
+        self.calls += 1
+        self.waited_sec += wait
+        return wait
+
+    def reconcile(self, est_tokens: int, actual_tokens: Optional[int]):
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.credit(est_tokens - actual_tokens)
+
+
+class RateLimiter:
+    """
+    Process-wide limiter shared by every LLM client (through retry_helpers).
+    Models without configured limits pass straight through.
+    """
+
+    def __init__(self):
+        self._limits: Dict[str, ModelRateLimit] = {}
+
+    def configure(self, model: str, rpm: Optional[float] = None, tpm: Optional[float] = None, **kwargs):
+        self._limits[model] = ModelRateLimit(rpm, tpm, **kwargs)
+
+    def get(self, model: str) -> Optional[ModelRateLimit]:
+        return self._limits.get(model)
+
+    def acquire(self, model: str, est_tokens: int):
+        limit = self._limits.get(model)
+        if limit is not None:
+            wait = limit.reserve(est_tokens)
+            if wait > 0:
+                time.sleep(wait)
+
+    async def aacquire(self, model: str, est_tokens: int):
+        limit = self._limits.get(model)
+        if limit is not None:
+            wait = limit.reserve(est_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def reconcile(self, model: str, est_tokens: int, resp=None):
+        """
+        Corrects the token bucket with the real usage of a completed call; a failed call
+        (resp=None) consumed no tokens, so its whole estimate is returned.
+        """
+        limit = self._limits.get(model)
+        if limit is None:
+            return
+        if resp is None:
+            limit.reconcile(est_tokens, 0)
+            return
+        usage = resp.get("usage") or {}
+        limit.reconcile(est_tokens, usage.get("total_tokens"))
+
+    def observe_headers(self, model: str, headers: Optional[Mapping]):
+        """
+        Feeds the provider's view of the quota back into the buckets:
+          - x-ratelimit-limit-{requests,tokens} configure an unconfigured model on first sight
+          - x-ratelimit-remaining-* caps the local bucket at what the server says is left
+          - remaining == 0 pushes the bucket into debt until x-ratelimit-reset-*, so every
+            worker waits for the reset instead of each discovering it through a 429
+        """
+        if not headers:
+            return
+        limit = self._limits.get(model)
+        if limit is None:
+            rpm = _as_int(header_lookup(headers, "x-ratelimit-limit-requests"))
+            tpm = _as_int(header_lookup(headers, "x-ratelimit-limit-tokens"))
+            if not (rpm or tpm):
+                return
+            self.configure(model, rpm, tpm)
+            limit = self._limits[model]
+
+        for kind, bucket in (("requests", limit.requests), ("tokens", limit.tokens)):
+            if bucket is None:
+                continue
+            remaining = _as_int(header_lookup(headers, f"x-ratelimit-remaining-{kind}"))
+            if remaining is None:
+                continue
+            if remaining <= 0:
+                reset = parse_duration(header_lookup(headers, f"x-ratelimit-reset-{kind}")) or 0.0
+                bucket.set_level(-reset * bucket.rate_per_sec)
+            else:
+                bucket.set_level(min(bucket.level, remaining))
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                "calls": lim.calls,
+                "waited_sec": lim.waited_sec,
+                "request_level": lim.requests.level if lim.requests else None,
+                "token_level": lim.tokens.level if lim.tokens else None,
+            }
+            for model, lim in self._limits.items()
+        }
+
+
+_limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    return _limiter
+
+
+def configure_rate_limits(limits: Dict[str, Dict[str, float]], **kwargs) -> RateLimiter:
+    """
+    limits: {"gpt-4o": {"rpm": 500, "tpm": 30000}, ...}; extra kwargs (headroom, burst_sec)
+    apply to every model.
+    """
+    for model, quota in limits.items():
+        _limiter.configure(model, quota.get("rpm"), quota.get("tpm"), **kwargs)
+    return _limiter
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Request parameters that do not change the completion and so are left out of the key
+_TRANSPORT_PARAMS = {"request_timeout", "api_key", "api_base", "api_type", "api_version",
+                     "organization", "headers", "stream"}
+
+
+def make_cache_key(kwargs: Dict[str, Any]) -> str:
+    """
+    Content address of a chat-completion request: sha256 over model, messages and
+    sampling parameters (canonical JSON, sorted keys).
+    """
+    payload = {k: v for k, v in kwargs.items() if k not in _TRANSPORT_PARAMS}
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of chat-completion responses.
+
+    - max_bytes: total payload size; least-recently-used entries are evicted beyond it
+    - ttl_sec: entries older than this are treated as misses and dropped (None = never expire)
+    """
+
+    def __init__(self, path: str = "cache/responses.sqlite", max_bytes: int = 512 * 1024 * 1024,
+                 ttl_sec: Optional[float] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_sec is not None and now - row[1] > self.ttl_sec:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Any):
+        blob = json.dumps(response, ensure_ascii=False, default=str)
+        size = len(blob.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, blob, size, now, now),
+            )
+            self._evict_locked()
+
+    def _evict_locked(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"entries": entries, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ---- Process-wide cache used by retry_helpers (None = caching off)
+_cache: Optional[ResponseCache] = None
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    global _cache
+    _cache = cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _cache
+
+
+def configure_response_cache(path: str = os.path.join("cache", "responses.sqlite"), **kwargs) -> ResponseCache:
+    """
+    Turns on the shared response cache (see ResponseCache for max_bytes / ttl_sec).
+    """
+    cache = ResponseCache(path, **kwargs)
+    set_response_cache(cache)
+    return cache
@@ -0,0 +1,81 @@
+import csv
+import os
+from pathlib import Path
+
+
+def append_dicts_to_csv(rows, filepath):
+    """
+    Append one or more dict rows to a CSV.
+    - Creates the file (and parent folder) if missing.
+    - Writes header once (on first creation).
+    - Uses existing header thereafter; extra keys are ignored; missing keys become empty cells.
+    """
+    if not rows:
+        return
+
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+
+    file_exists = os.path.exists(filepath) and os.path.getsize(filepath) > 0
+    header = None
+
+    if file_exists:
+        # Read existing header to preserve column order
+        with open(filepath, "r", newline="", encoding="utf-8") as rf:
+            reader = csv.reader(rf)
+            header = next(reader, None)
+            if not header:
+                file_exists = False  # treat as new file if header missing
+
+    if not file_exists:
+        # First write: compute header from provided rows (first-seen key order)
+        seen = set()
+        header = []
+        for r in rows:
+            for k in r.keys():
+                if k not in seen:
+                    seen.add(k)
+                    header.append(k)
+        with open(filepath, "w", newline="", encoding="utf-8") as wf:
+            writer = csv.DictWriter(wf, fieldnames=header, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+
+    # Append using existing header
+    with open(filepath, "a", newline="", encoding="utf-8") as af:
+        writer = csv.DictWriter(af, fieldnames=header, extrasaction="ignore")
+        for r in rows:
+            writer.writerow(r)
+
+def load_complete_rows(filepath):
+    """
+    Reads the rows of a CSV written by append_dicts_to_csv, skipping anything a crash
+    may have left half-written: a trailing record without its line terminator, or a
+    row with missing cells. If a partial tail is found the file is rewritten without
+    it, so later appends start on a clean line. Returns [] for a missing/empty file.
+    """
+    if not (os.path.exists(filepath) and os.path.getsize(filepath) > 0):
+        return []
+
+    with open(filepath, "r", newline="", encoding="utf-8") as rf:
+        text = rf.read()
+
+    records = list(csv.reader(text.splitlines(keepends=True)))
+    if not records:
+        return []
+    header, body = records[0], records[1:]
+
+    truncated = not text.endswith(("\n", "\r"))
+    if truncated and body:
+        body = body[:-1]
+    complete = [r for r in body if len(r) == len(header)]
+
+    if truncated or len(complete) != len(body):
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as wf:
+            writer = csv.writer(wf)
+            writer.writerow(header)
+            writer.writerows(complete)
+        os.replace(tmp_path, filepath)
+
+    return [dict(zip(header, r)) for r in complete]
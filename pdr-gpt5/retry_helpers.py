@@ -1,7 +1,21 @@
 # retry_helpers.py
+import asyncio
 import time, random, json
+from contextlib import nullcontext
 import openai
 
+from concurrency import record_outcome, request_slot
+from response_cache import get_response_cache, make_cache_key
+from cassette import get_cassette
+from circuit_breaker import CircuitOpenError, get_breaker
+from hedging import get_hedge_policy
+from http_pool import pooled_session
+from streaming import aconsume_stream
+from rate_limiter import get_rate_limiter, header_lookup, parse_duration
+from telemetry import current_run, queue_wait
+from async_runner import run_sync
+from token_utils import estimate_request_tokens
+
 # Older SDK exposes exceptions under openai.error.*
 try:
     from openai import error as oe  # type: ignore
@@ -50,27 +64,236 @@ def _is_retryable(e) -> bool:
 
     return False
 
-def chat_with_retries(
+def _error_headers(e):
+    headers = getattr(e, "headers", None)
+    if not headers:
+        headers = getattr(getattr(e, "response", None), "headers", None)
+    return headers or None
+
+def _response_headers(resp):
+    # openai 0.27 drops response headers on success; newer clients / wrappers may keep them
+    for attr in ("headers", "_headers", "response_headers"):
+        headers = getattr(resp, attr, None)
+        if headers:
+            return headers
+    return None
+
+def _retry_after_hint(e):
+    """
+    Seconds the server asked us to wait, from Retry-After(-ms) or, for an exhausted
+    quota, the matching x-ratelimit-reset-* header. None if the error carries no hint.
+    """
+    headers = _error_headers(e)
+    if not headers:
+        return None
+    ms = parse_duration(header_lookup(headers, "retry-after-ms"))
+    if ms is not None:
+        return ms / 1000.0
+    retry_after = parse_duration(header_lookup(headers, "retry-after"))
+    if retry_after is not None:
+        return retry_after
+
+    resets = []
+    for kind in ("requests", "tokens"):
+        reset = parse_duration(header_lookup(headers, f"x-ratelimit-reset-{kind}"))
+        if reset is None:
+            continue
+        remaining = header_lookup(headers, f"x-ratelimit-remaining-{kind}")
+        if remaining is not None and str(remaining).strip() not in ("0", "0.0"):
+            continue  # this quota is not the one we ran out of
+        resets.append(reset)
+    return max(resets) if resets else None
+
+def _backoff_delay(attempt: int, base: float, cap: float, jitter: float, hint=None,
+                   max_hint: float = 120.0) -> float:
+    """
+    Sleep before the next attempt: the server's hint when it gave one (plus a small jitter
+    so waiting workers don't all fire at the reset instant), else capped exponential backoff.
+    """
+    if hint is not None:
+        return min(max_hint, hint) * (1.0 + 0.1 * jitter * random.random())
+    return min(cap, base * (2 ** (attempt - 1))) * (1.0 + jitter * random.random())
+
+def _prepare(kwargs, cache_bypass: bool):
+    """
+    Shared front half of the call layer: cassette replay, then the response cache.
+    Returns (response or None, replay latency, request key, cache).
+    """
+    cassette = get_cassette()
+    cache = None if cache_bypass else get_response_cache()
+    key = make_cache_key(kwargs) if (cassette is not None or cache is not None) else None
+    if cassette is not None and cassette.replaying:
+        resp, latency = cassette.play(key, kwargs.get("model", ""))
+        return resp, latency, key, None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, 0.0, key, cache
+    return None, 0.0, key, cache
+
+def _finish(resp, kwargs, key, cache, started: float, from_network: bool):
+    """
+    Shared back half: store a fresh response in the cache and record it on the cassette.
+    Prompt / provider-cached token usage of network responses goes to the run's telemetry.
+    Streams cut short by a monitor are recorded but not cached (the cut depends on the monitor).
+    """
+    stats = resp.get("stream_stats") if isinstance(resp, dict) else None
+    run = current_run() if from_network else None
+    if run is not None:
+        run.add_usage(resp.get("usage") or {})
+        if stats is not None:
+            run.add_stream_stats(stats)
+    if from_network and cache is not None and not (stats or {}).get("aborted"):
+        cache.put(key, resp)
+    cassette = get_cassette()
+    if cassette is not None and not cassette.replaying:
+        cassette.record(key, kwargs.get("model", ""), resp, time.time() - started)
+    return resp
+
+async def _acreate(model: str, request_timeout: int, hedge: bool, kwargs, stream_monitor=None):
+    """
+    One network call over the pooled HTTP session (http_pool.configure_http_pool).
+    Streamed requests (stream=True) are read to the end, or until stream_monitor asks
+    to abort, and returned as a regular response dict (see streaming.aconsume_stream).
+    With a hedging policy configured, hedge-eligible non-streamed calls feed their
+    latency to it and may be duplicated when slower than the learned percentile.
+    Returns (response, response headers captured by the pool or {}).
+    """
+    policy = get_hedge_policy() if hedge and not kwargs.get("stream") else None
+    with pooled_session() as headers:
+        if kwargs.get("stream"):
+            t0 = time.monotonic()
+            chunks = await openai.ChatCompletion.acreate(request_timeout=request_timeout, **kwargs)
+            return await aconsume_stream(chunks, stream_monitor, started=t0), headers
+        if policy is None:
+            resp = await openai.ChatCompletion.acreate(request_timeout=request_timeout, **kwargs)
+            return resp, headers
+        t0 = time.monotonic()
+        resp = await policy.run(
+            model, lambda: openai.ChatCompletion.acreate(request_timeout=request_timeout, **kwargs)
+        )
+        policy.observe(model, time.monotonic() - t0)
+        return resp, headers
+
+def chat_with_retries(**kwargs):
+    """
+    Blocking wrapper around achat_with_retries (same keyword arguments), run on the
+    shared background loop: sync callers get the same call layer -- cache, cassette,
+    rate limits, circuit breaker and in-flight caps -- as async ones.
+    Must not be called from a coroutine on that loop; await achat_with_retries instead.
+    """
+    return run_sync(achat_with_retries(**kwargs))
+
+async def achat_with_retries(
     *,
     max_attempts: int = 6,
     base: float = 0.5,
     cap: float = 10.0,
     jitter: float = 0.3,
     request_timeout: int = 90,
+    cache_bypass: bool = False,
+    hedge: bool = False,
+    stream_monitor=None,
     **kwargs
 ):
     """
-    Wrapper for openai.ChatCompletion.create with exponential backoff + jitter.
-    Retries on 429, 5xx, and network-ish failures. Passes through **kwargs.
+    openai.ChatCompletion.acreate with exponential backoff + jitter. Passes through **kwargs.
+    Retries on 429, 5xx, and network-ish failures; when the error carries Retry-After /
+    x-ratelimit-reset-* headers, the sleep is exactly that long instead of the exponential
+    guess, and rate-limit headers are fed to the shared rate limiter so other workers back
+    off too. Served from / stored in the shared response cache when one is configured,
+    unless cache_bypass=True (e.g. sampled generations that must stay fresh); with an
+    active cassette, responses are recorded or replayed (see cassette.py).
+    Backoff sleeps yield to the event loop. Each attempt first waits for the model's
+    RPM/TPM budget (rate_limiter.configure_rate_limits), then holds an in-flight slot
+    (concurrency.configure_request_limits); the slot is released while backing off.
+    Raises CircuitOpenError without calling the model while its circuit is open.
+    hedge=True lets the hedging policy (hedging.configure_hedging) duplicate a slow call;
+    the duplicate shares the attempt's in-flight slot and budget reservation.
+    stream=True requests are consumed incrementally; stream_monitor (e.g.
+    streaming.RubricStreamMonitor) can abort them early. Their ttft / tokens-per-sec
+    are recorded on the active run's telemetry.
     """
+    started = time.time()
+    resp, latency, key, cache = _prepare(kwargs, cache_bypass)
+    if resp is not None:
+        if latency:
+            await asyncio.sleep(latency)
+        return _finish(resp, kwargs, key, cache, started, from_network=False)
+
+    model = kwargs.get("model", "")
+    limiter = get_rate_limiter()
+    est_tokens = estimate_request_tokens(kwargs)
+    breaker = get_breaker(model)
     last_err = None
     for attempt in range(1, max_attempts + 1):
+        # A tripped breaker stops the backoff ladder so the caller can fall back right away
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(model) from last_err
+        settled = False  # an outcome reached the breaker
         try:
-            return openai.ChatCompletion.create(request_timeout=request_timeout, **kwargs)
-        except Exception as e:
-            last_err = e
-            if not _is_retryable(e) or attempt >= max_attempts:
-                raise
-            sleep = min(cap, base * (2 ** (attempt - 1))) * (1.0 + jitter * random.random())
-            time.sleep(sleep)
+            # Wait for RPM/TPM budget before taking an in-flight slot
+            with queue_wait():
+                await limiter.aacquire(model, est_tokens)
+            run = current_run()
+            if run is not None:
+                run.llm_calls += 1
+            try:
+                async with request_slot(model):
+                    with run.executing() if run is not None else nullcontext():
+                        resp, headers = await _acreate(model, request_timeout, hedge, kwargs, stream_monitor)
+                limiter.reconcile(model, est_tokens, resp)
+                limiter.observe_headers(model, _response_headers(resp) or headers)
+                record_outcome(model, ok=True)
+                if breaker is not None:
+                    breaker.record_success()
+                    settled = True
+                return _finish(resp, kwargs, key, cache, started, from_network=True)
+            except Exception as e:
+                limiter.reconcile(model, est_tokens, None)
+                limiter.observe_headers(model, _error_headers(e))
+                last_err = e
+                retryable = _is_retryable(e)
+                if retryable:
+                    # 429/5xx/network: shrink the model's adaptive concurrency limit
+                    record_outcome(model, ok=False)
+                    if breaker is not None:
+                        breaker.record_failure()
+                        settled = True
+                if not retryable or attempt >= max_attempts:
+                    raise
+                await asyncio.sleep(_backoff_delay(attempt, base, cap, jitter, _retry_after_hint(e)))
+        finally:
+            # Cancellation and non-retryable errors record nothing: hand back a half-open probe
+            if breaker is not None and not settled:
+                breaker.release_probe()
     raise last_err
+
+async def achat_with_circuit_fallback(
+    kwargs,
+    fallback_models=(),
+    reroute=None,
+    **retry_kwargs
+):
+    """
+    achat_with_retries on kwargs["model"]; if that model's circuit is open (or trips
+    while retrying) the request goes straight to the next model in fallback_models.
+    reroute(kwargs, model) adapts the request for a fallback model (default: swap "model").
+    Reroutes are counted on the active run's telemetry.
+    """
+    routes = [kwargs.get("model", "")] + [m for m in fallback_models if m != kwargs.get("model")]
+    for i, model in enumerate(routes):
+        if i == 0:
+            call_kwargs = kwargs
+        elif reroute is not None:
+            call_kwargs = reroute(kwargs, model)
+        else:
+            call_kwargs = {**kwargs, "model": model}
+        try:
+            return await achat_with_retries(**retry_kwargs, **call_kwargs)
+        except CircuitOpenError:
+            if i + 1 >= len(routes):
+                raise
+            run = current_run()
+            if run is not None:
+                run.reroutes += 1
@@ -0,0 +1,220 @@
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from code_checks import check_commit_messages, check_python_code
+
+# Same notion of a word as str.split(): maximal runs of non-whitespace
+_WORDS = re.compile(r"\S+")
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over lowercased keywords: one left-to-right pass over the
+    text finds every keyword occurring as a substring (case-insensitive), instead of one
+    `kw in text.lower()` scan per keyword.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = list(dict.fromkeys(kw.lower() for kw in keywords if kw))
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[int]] = [set()]
+        for idx, kw in enumerate(self.keywords):
+            state = 0
+            for ch in kw:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                    self._goto[state][ch] = nxt
+                state = nxt
+            self._out[state].add(idx)
+        self._link()
+
+    def _link(self):
+        # Breadth-first failure links; each state also inherits its fallback's matches
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Set[int]:
+        """
+        Indices (into self.keywords) of the keywords present in `text`.
+        """
+        found: Set[int] = set()
+        wanted = len(self.keywords)
+        if not wanted:
+            return found
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+                if len(found) == wanted:
+                    break
+        return found
+
+
+# ---- Check types: rubric key -> factory(spec) returning a predicate over the output text
+_CHECKS: Dict[str, Callable[[object], Callable[[str], object]]] = {}
+
+
+def register_check(name: str):
+    """
+    Registers a rubric check type. The decorated factory receives the rubric value
+    stored under `name` and returns a predicate text -> bool, or text -> dict with
+    "ok" and a "failures" list of readable reasons (used for feedback).
+    """
+    def decorator(factory):
+        _CHECKS[name] = factory
+        return factory
+    return decorator
+
+
+@register_check("regex")
+def _regex_check(patterns):
+    compiled = [re.compile(p, re.MULTILINE) for p in ([patterns] if isinstance(patterns, str) else patterns)]
+    return lambda text: all(p.search(text) for p in compiled)
+
+
+@register_check("code_fence")
+def _code_fence_check(language):
+    # code_fence: True (any fenced block) or a language tag such as "python"
+    tag = "" if language is True else re.escape(str(language))
+    pattern = re.compile(rf"^\s*```{tag}[^\n]*\n.*?^\s*```", re.MULTILINE | re.DOTALL)
+    return lambda text: pattern.search(text) is not None
+
+
+@register_check("headers")
+def _headers_check(headers):
+    # A header is a line holding just the heading, optionally behind markdown '#'s,
+    # bold markers or a "1)" / "2." numbering, optionally followed by ':'
+    compiled = [
+        re.compile(
+            rf"^[ \t]*(?:#+[ \t]*)?(?:\d+[.)][ \t]*)?(?:\*\*)?{re.escape(h)}(?:\*\*)?[ \t]*:?(?:\*\*)?[ \t]*$",
+            re.MULTILINE | re.IGNORECASE,
+        )
+        for h in headers
+    ]
+    return lambda text: all(p.search(text) for p in compiled)
+
+
+@register_check("python_code")
+def _python_code_check(spec):
+    # python_code: kwargs for code_checks.check_python_code (blocks, min_asserts, min_tests, ...)
+    return lambda text: check_python_code(text, **spec)
+
+
+@register_check("commit_messages")
+def _commit_messages_check(spec):
+    # commit_messages: kwargs for code_checks.check_commit_messages (count, ticket, ...)
+    return lambda text: check_commit_messages(text, **spec)
+
+
+class CompiledRubric:
+    """
+    A task rubric compiled once into a reusable matcher.
+
+    - word count: precompiled tokenizer, same counting rule as str.split()
+    - must_include: one KeywordAutomaton pass; results name the missing keywords
+    - extra checks: any registered check type present in the rubric ("regex",
+      "code_fence", "headers", ...), reported per check name
+
+    Scoring keeps the Evaluator's scale: 50 base, +25 for word count, +25 when every
+    keyword is present and every extra check passes.
+
+    With deterministic checks (rubric "decisive_checks": True) the result is marked
+    "decisive" once they settle it either way (a check failed, or everything passed), and
+    "check_failures" lists the reasons; the Evaluator then skips the LLM analysis.
+    """
+
+    def __init__(self, rubric: dict):
+        self.rubric = rubric
+        self.min_words, self.max_words = rubric["word_count_range"]
+        self.must_include: List[str] = list(rubric.get("must_include", []))
+        self.automaton = KeywordAutomaton(self.must_include)
+        self.evaluation_instructions: Optional[str] = rubric.get("evaluation_instructions")
+        self.checks = [(name, factory(rubric[name])) for name, factory in _CHECKS.items() if name in rubric]
+        self.execute_tests: Optional[dict] = rubric.get("execute_tests")
+        self.decisive_checks = bool(rubric.get("decisive_checks")) and bool(self.checks or self.execute_tests)
+
+    def __getitem__(self, key):
+        # Still usable wherever the raw rubric dict is expected
+        return self.rubric[key]
+
+    def get(self, key, default=None):
+        return self.rubric.get(key, default)
+
+    def word_count(self, text: str) -> int:
+        return sum(1 for _ in _WORDS.finditer(text))
+
+    def missing_keywords(self, text: str) -> List[str]:
+        found = self.automaton.find(text)
+        present = {self.automaton.keywords[i] for i in found}
+        return [kw for kw in self.must_include if kw.lower() not in present]
+
+    def check(self, text: str) -> dict:
+        word_count = self.word_count(text)
+        word_count_ok = self.min_words <= word_count <= self.max_words
+        missing = self.missing_keywords(text)
+        checks, failures = {}, []
+        for name, predicate in self.checks:
+            outcome = predicate(text)
+            if isinstance(outcome, dict):
+                checks[name] = bool(outcome["ok"])
+                failures += outcome.get("failures", [])
+            else:
+                checks[name] = bool(outcome)
+                if not outcome:
+                    failures.append(f"{name} check failed")
+        results = {
+            "word_count": word_count,
+            "word_count_ok": word_count_ok,
+            "must_include_ok": not missing,
+            "missing_keywords": missing,
+            "checks": checks,
+            "check_failures": failures,
+        }
+        self._score(results)
+        return results
+
+    def _score(self, results: dict):
+        results["checks_ok"] = all(results["checks"].values())
+        score = 50
+        if results["word_count_ok"]:
+            score += 25
+        if results["must_include_ok"] and results["checks_ok"]:
+            score += 25
+        results["score"] = score
+        results["decisive"] = self.decisive_checks and (not results["checks_ok"] or score == 100)
+
+    def add_check(self, results: dict, name: str, ok: bool, failures: Iterable[str] = ()):
+        """
+        Folds the outcome of a check computed outside check() (e.g. executing generated
+        tests) into `results`, rescoring it the same way.
+        """
+        results["checks"][name] = bool(ok)
+        results["check_failures"] += list(failures)
+        self._score(results)
+
+    def check_batch(self, texts: Iterable[str]) -> List[dict]:
+        return [self.check(text) for text in texts]
+
+
+def compile_rubric(rubric) -> CompiledRubric:
+    """
+    `rubric` as a CompiledRubric (returned unchanged when already compiled).
+    """
+    return rubric if isinstance(rubric, CompiledRubric) else CompiledRubric(rubric)
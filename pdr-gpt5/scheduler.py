@@ -0,0 +1,193 @@
+import asyncio
+import time
+from itertools import product
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from async_runner import run_sync
+from concurrency import configure_adaptive_limits, configure_request_limits, limit_stats
+from http_pool import http_pool_stats
+from budget_learner import budget_stats
+from pytest_sandbox import sandbox_stats
+from results_io import append_dicts_to_csv, load_complete_rows
+from simulate_participant import Participant
+
+
+class ExperimentJob:
+    """
+    One cell of the experiment grid: run `method` for (participant, task) on `model`.
+    """
+
+    def __init__(self, participant, task, method: str, model: str):
+        self.participant = participant
+        self.task = task
+        self.method = method
+        self.model = model
+
+    @property
+    def key(self):
+        return (self.participant.name, self.task.name, self.method, self.model)
+
+    def __repr__(self):
+        return f"ExperimentJob({self.method}, {self.model}, {self.participant.name}, {self.task.name})"
+
+
+def build_jobs(participants, tasks, methods: Iterable[str], models: Iterable[str]) -> List[ExperimentJob]:
+    """
+    Expands the full (participant, task, method, model) matrix into jobs.
+    Each job gets its own Participant bound to the job's model (same name/persona).
+    """
+    jobs = []
+    for model, method, participant, task in product(list(models), list(methods), participants, tasks):
+        bound = Participant(participant.name, participant.persona_description, model=model)
+        jobs.append(ExperimentJob(bound, task, method, model))
+    return jobs
+
+
+def load_completed_keys(filepath: str, method: Optional[str] = None, model: Optional[str] = None) -> set:
+    """
+    Index of (participant_name, task_name, method, model) keys already present in a results CSV.
+    `method` / `model` fill in for files written without those columns (one file per method/model).
+    """
+    keys = set()
+    for row in load_complete_rows(filepath):
+        row_method = row.get("method") or method
+        row_model = row.get("model") or model
+        if row.get("participant_name") and row.get("task_name") and row.get("final_score") not in (None, ""):
+            keys.add((row["participant_name"], row["task_name"], row_method, row_model))
+    return keys
+
+
+class ExperimentScheduler:
+    """
+    Runs experiment jobs concurrently on one event loop.
+
+    - simulators: method name -> simulator (anything with `asimulate(participant, task)`)
+    - results_path: "{method}"/"{model}" format string, or a callable (method, model) -> path;
+      each finished row is appended to its file immediately via append_dicts_to_csv
+    - max_workers: jobs running at once (across all models)
+    - model_concurrency: optional per-model cap on jobs running at once
+    - max_inflight_requests / model_inflight_requests: global / per-model caps on
+      chat-completion requests in flight (enforced in retry_helpers)
+    - adaptive_inflight: make the per-model request caps AIMD limits that grow on success
+      and halve on 429/5xx (model_inflight_requests then only seeds them)
+    """
+
+    def __init__(
+        self,
+        simulators: Dict[str, object],
+        results_path: Union[str, Callable[[str, str], str]],
+        max_workers: int = 8,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        max_inflight_requests: Optional[int] = None,
+        model_inflight_requests: Optional[Dict[str, int]] = None,
+        adaptive_inflight: bool = False,
+        verbose: bool = True,
+    ):
+        self.simulators = simulators
+        self.results_path = results_path
+        self.max_workers = max_workers
+        self.model_concurrency = model_concurrency or {}
+        self.max_inflight_requests = max_inflight_requests
+        self.model_inflight_requests = model_inflight_requests or {}
+        self.adaptive_inflight = adaptive_inflight
+        self.verbose = verbose
+
+    def path_for(self, method: str, model: str) -> str:
+        if callable(self.results_path):
+            return self.results_path(method, model)
+        return self.results_path.format(method=method, model=model)
+
+    def pending_jobs(self, jobs: List[ExperimentJob]) -> List[ExperimentJob]:
+        """
+        Drops jobs whose key is already recorded in their results file.
+        """
+        completed = set()
+        for method, model in {(job.method, job.model) for job in jobs}:
+            completed |= load_completed_keys(self.path_for(method, model), method, model)
+        return [job for job in jobs if job.key not in completed]
+
+    def run(self, jobs: List[ExperimentJob], resume: bool = False) -> dict:
+        return run_sync(self.arun(jobs, resume=resume))
+
+    async def arun(self, jobs: List[ExperimentJob], resume: bool = False) -> dict:
+        """
+        Runs all jobs and returns a summary with throughput (jobs/min) overall and per model.
+        A failing job (including one that raises CancelledError from inside) is reported
+        and skipped; it does not stop the rest of the grid.
+        With resume=True, jobs already present in the results files are skipped, so a
+        crashed run can be restarted against the same files and only pays for the rest.
+        """
+        if self.adaptive_inflight:
+            configure_request_limits(self.max_inflight_requests)
+            configure_adaptive_limits(self.model_inflight_requests)
+        else:
+            configure_request_limits(self.max_inflight_requests, self.model_inflight_requests)
+
+        skipped = 0
+        if resume:
+            pending = self.pending_jobs(jobs)
+            skipped = len(jobs) - len(pending)
+            jobs = pending
+            if self.verbose:
+                print(f"Resuming: {skipped} jobs already completed, {len(jobs)} to run")
+
+        workers = asyncio.Semaphore(max(1, self.max_workers))
+        per_model = {m: asyncio.Semaphore(max(1, n)) for m, n in self.model_concurrency.items()}
+        start = time.time()
+        stats = {"completed": 0, "failed": 0, "failures": [], "per_model": {}}
+
+        async def run_job(job: ExperimentJob):
+            model_sem = per_model.get(job.model)
+            if model_sem is not None:
+                await model_sem.acquire()
+            try:
+                async with workers:
+                    row = await self.simulators[job.method].asimulate(job.participant, job.task)
+            except (Exception, asyncio.CancelledError) as e:
+                # A CancelledError raised inside the job fails only that job; the grid
+                # itself being cancelled (cancelling() > 0) still stops everything
+                if isinstance(e, asyncio.CancelledError) and asyncio.current_task().cancelling():
+                    raise
+                stats["failed"] += 1
+                stats["failures"].append({"job": job.key, "error": str(e) or type(e).__name__})
+                if self.verbose:
+                    print(f"[FAILED] {job}: {str(e) or type(e).__name__}")
+                return
+            finally:
+                if model_sem is not None:
+                    model_sem.release()
+
+            row = {"model": job.model, "method": job.method, **row}
+            append_dicts_to_csv([row], self.path_for(job.method, job.model))
+
+            stats["completed"] += 1
+            model_stats = stats["per_model"].setdefault(job.model, {"completed": 0})
+            model_stats["completed"] += 1
+            if self.verbose:
+                done = stats["completed"] + stats["failed"]
+                print(f"[{done}/{len(jobs)}] {job.method} {job.model} {job.participant.name} / {job.task.name}: "
+                      f"score={row.get('final_score')}, time={row.get('time_spent_sec', 0):.2f}s "
+                      f"(+{row.get('queue_wait_sec', 0):.2f}s queued), "
+                      f"{self._per_min(stats['completed'], time.time() - start):.2f} jobs/min")
+
+        await asyncio.gather(*(run_job(job) for job in jobs))
+
+        elapsed = time.time() - start
+        stats["jobs"] = len(jobs)
+        stats["skipped"] = skipped
+        stats["elapsed_sec"] = elapsed
+        stats["jobs_per_min"] = self._per_min(stats["completed"], elapsed)
+        stats["request_limits"] = limit_stats()
+        stats["http_pool"] = http_pool_stats()
+        stats["token_budgets"] = budget_stats()
+        stats["sandbox"] = sandbox_stats()
+        for model_stats in stats["per_model"].values():
+            model_stats["jobs_per_min"] = self._per_min(model_stats["completed"], elapsed)
+        if self.verbose:
+            print(f"Grid finished: {stats['completed']}/{len(jobs)} jobs in {elapsed:.1f}s "
+                  f"({stats['jobs_per_min']:.2f} jobs/min), {stats['failed']} failed")
+        return stats
+
+    @staticmethod
+    def _per_min(count: int, elapsed_sec: float) -> float:
+        return count / (elapsed_sec / 60.0) if elapsed_sec > 0 else 0.0
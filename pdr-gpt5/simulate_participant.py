@@ -1,9 +1,14 @@
+import asyncio
 import openai
 import os
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, Union
 
 # uses the helper we created earlier
-from retry_helpers import chat_with_retries
+from retry_helpers import achat_with_circuit_fallback
+from async_runner import run_sync
+from circuit_breaker import CircuitOpenError
+from streaming import RubricStreamMonitor
+from budget_learner import answering_model, completion_tokens, first_attempt_budget, get_budget_learner
 
 
 class Participant:
@@ -17,6 +22,9 @@ class Participant:
     # Models that accept `verbosity` (best-effort guard; won't include param for others)
     _HAS_VERBOSITY_MODELS = {"gpt-4o", "gpt-5-mini"}
 
+    # Models that rejected `n` > 1; filled in at runtime, shared by all participants
+    _NO_N_MODELS = set()
+
     def __init__(self, name: str, persona_description: str, model: str = "gpt-4o"):
         self.name = name
         self.persona_description = persona_description
@@ -27,43 +35,84 @@ class Participant:
         messages: List[Dict[str, Any]],
         max_comp_tokens: int,
         temperature: Optional[float],
+        model: Optional[str] = None,
+        stream: bool = False,
         # remove reasoning_effort/verbosity from signature or ignore them
         **_
     ) -> Dict[str, Any]:
+        model = model or self.model
         kwargs: Dict[str, Any] = {
-            "model": self.model,
+            "model": model,
             "messages": messages,
             # ChatCompletion expects 'max_tokens'
             "max_tokens": max_comp_tokens,
         }
         # Only pass temperature for models that support it (your list keeps gpt-4o out)
-        if temperature is not None and self.model not in self._NO_TEMPERATURE_MODELS:
+        if temperature is not None and model not in self._NO_TEMPERATURE_MODELS:
             kwargs["temperature"] = temperature
         # Do NOT add 'verbosity' or 'reasoning_effort' for ChatCompletion
+        if stream:
+            kwargs["stream"] = True
+            kwargs["stream_options"] = {"include_usage": True}  # usage arrives in the last chunk
         return kwargs
 
+    def _route_kwargs(self, kwargs: Dict[str, Any], model: str) -> Dict[str, Any]:
+        # Same request re-targeted at a fallback model (circuit breaker routing)
+        routed = {**kwargs, "model": model}
+        if model in self._NO_TEMPERATURE_MODELS:
+            routed.pop("temperature", None)
+        return routed
+
 
-    def _call(
+    @staticmethod
+    def _user_turns(user_instruction: Union[str, List[Dict[str, Any]]], suffix: str = "") -> List[Dict[str, Any]]:
+        # A plain instruction is one user message; a list is a conversation (PromptHistory
+        # "conversation" layout) that follows the system prompt as-is
+        if isinstance(user_instruction, str):
+            return [{"role": "user", "content": user_instruction + suffix}]
+        turns = [dict(t) for t in user_instruction]
+        if suffix.strip():
+            # Own trailing turn: the shared turns before it stay a cacheable prefix
+            turns.append({"role": "user", "content": suffix.strip()})
+        return turns
+
+    async def _acall(
         self,
         kwargs: Dict[str, Any],
         network_attempts: int,
         request_timeout: int,
         debug: bool,
         label: str,
+        cache_bypass: bool = False,
+        fallback_models: Tuple[str, ...] = (),
+        hedge: bool = False,
+        stream_monitor: Optional[RubricStreamMonitor] = None,
     ):
-        resp = chat_with_retries(
+        # While kwargs["model"]'s circuit is open, go straight to fallback_models
+        resp = await achat_with_circuit_fallback(
+            kwargs,
+            fallback_models,
+            reroute=self._route_kwargs,
             max_attempts=network_attempts,
             request_timeout=request_timeout,
-            **kwargs
+            cache_bypass=cache_bypass,
+            hedge=hedge,
+            stream_monitor=stream_monitor,
         )
         if debug:
             print(f"{label} KWARGS:", {k: v for k, v in kwargs.items() if k != "messages"})
             print(f"{label} RAW:", resp)
         return resp
 
-    def generate_output(
+    def generate_output(self, user_instruction: str, **kwargs) -> str:
+        """
+        Blocking wrapper around agenerate_output (same keyword arguments).
+        """
+        return run_sync(self.agenerate_output(user_instruction, **kwargs))
+
+    async def agenerate_output(
         self,
-        user_instruction: str,
+        user_instruction: Union[str, List[Dict[str, Any]]],
         temperature: float = 0.7,
         max_tokens: int = 1000,
         max_retries: int = 1,                 # content-based retry (empty/length)
@@ -72,19 +121,40 @@ class Participant:
         allow_model_fallback: bool = True,    # try a non-reasoning model if GPT-4o still empty
         fallback_models: Tuple[str, ...] = ("gpt-4o",),
         debug: bool = False,
+        cache_bypass: Optional[bool] = None,  # skip the shared response cache; None = when temperature > 0
+        hedge: bool = True,                   # allow a duplicate request past the latency percentile
+        stream: bool = False,                 # stream tokens; with a rubric, abort over-long answers
+        rubric: Optional[dict] = None,
+        abort_margin: float = 0.2,            # abort once words exceed max word count * (1 + margin)
+        budget_key: Optional[str] = None,     # e.g. task name: learn the first-attempt max_tokens
     ) -> str:
         """
-        Simulates how this participant would respond to a given user instruction.
+        Simulates how this participant would respond to a given user instruction
+        (a string, or a list of user turns for the conversation prompt layout).
         Strategy:
           1) GPT-4o, minimal reasoning, normal budget.
-          2) If empty/length, GPT-4o again with strong code-only nudge + larger budget.
+          2) If empty/length, GPT-4o again with strong code-only nudge + larger budget
+             (an answer cut off by a learned first budget is retried as-is, no nudge).
           3) If still empty and allowed, fall back to a non-reasoning model (e.g., gpt-4o).
+        Calls are hedged only when a policy is configured (hedging.configure_hedging).
+        With stream=True and a task rubric, words and must_include hits are tracked as tokens
+        arrive and a generation running past the rubric's max length (plus abort_margin) is
+        cut off; the partial answer is returned and the evaluator scores it as too long.
+        With a budget learner configured (budget_learner.configure_budget_learner) and a
+        budget_key, attempt 1 uses the learned max_tokens for (model, budget_key) instead of
+        max_tokens, and every reply feeds the learner.
+        Sampled calls (temperature > 0) skip the shared response cache unless cache_bypass=False
+        is passed, so repeated candidates are fresh samples rather than one cached reply.
         """
+        if cache_bypass is None:
+            cache_bypass = bool(temperature)
         base_messages = [
             {"role": "system", "content": f"You are {self.name}. {self.persona_description}"},
-            {"role": "user", "content": user_instruction},
+            *self._user_turns(user_instruction),
         ]
 
+        monitor = RubricStreamMonitor(rubric, abort_margin) if (stream and rubric) else None
+
         def extract(resp):
             choice = resp["choices"][0]
             content = (choice.get("message") or {}).get("content") or ""
@@ -94,29 +164,45 @@ class Participant:
             reasoning_used = comp_details.get("reasoning_tokens", 0)
             return content.strip(), finish_reason, reasoning_used
 
+        if budget_key is not None:
+            budget_key = f"generate/{budget_key}"  # needs differ per caller role
+        learner = get_budget_learner() if budget_key is not None else None
+        first_budget = first_attempt_budget(self.model, budget_key, max_tokens)
+
         try:
             # ---- Attempt 1: GPT-4o, minimal reasoning, low verbosity
             kwargs1 = self._make_kwargs(
                 messages=base_messages,
-                max_comp_tokens=max_tokens,
+                max_comp_tokens=first_budget,
                 temperature=temperature,
                 # reasoning_effort="minimal",
                 verbosity="medium",
+                stream=stream,
+            )
+            resp1 = await self._acall(
+                kwargs1, network_attempts, request_timeout, debug, "REQUEST 1", cache_bypass,
+                fallback_models=fallback_models if allow_model_fallback else (), hedge=hedge,
+                stream_monitor=monitor,
             )
-            resp1 = self._call(kwargs1, network_attempts, request_timeout, debug, "REQUEST 1")
             content, finish_reason, reasoning_used = extract(resp1)
-            if content:
+            if learner is not None and finish_reason != "aborted":
+                learner.record(answering_model(resp1, self.model), budget_key, first_budget, completion_tokens(resp1),
+                               truncated=finish_reason == "length" or not content)
+            # A learned first budget may be tighter than the caller's max_tokens: an answer it
+            # cut off is retried with the bigger budget below instead of returned truncated
+            truncated = content if (finish_reason == "length" and first_budget != max_tokens) else ""
+            if content and not (truncated and max_retries > 0):
                 return content
 
             # Should we do a second attempt with a larger budget & stronger instruction?
             should_retry = (
                 finish_reason == "length"
-                or reasoning_used >= max(128, int(0.8 * max_tokens))
+                or reasoning_used >= max(128, int(0.8 * first_budget))
                 or not content
             )
 
             if should_retry and max_retries > 0:
-                retry_messages = [
+                retry_messages = base_messages if truncated else [
                     {
                         "role": "system",
                         "content": (
@@ -135,32 +221,43 @@ class Participant:
                     temperature=temperature,
                     # reasoning_effort="minimal",
                     verbosity="medium",
+                    stream=stream,
+                )
+                resp2 = await self._acall(
+                    kwargs2, network_attempts, request_timeout, debug, "REQUEST 2", cache_bypass,
+                    fallback_models=fallback_models if allow_model_fallback else (), hedge=hedge,
+                    stream_monitor=monitor,
                 )
-                resp2 = self._call(kwargs2, network_attempts, request_timeout, debug, "REQUEST 2")
                 content2, finish2, reasoning2 = extract(resp2)
                 if content2:
+                    if learner is not None and finish2 not in ("length", "aborted"):
+                        learner.record_need(answering_model(resp2, self.model), budget_key, completion_tokens(resp2))
                     return content2
+                if truncated:
+                    return truncated  # the cut-off first answer beats nothing
 
                 # Optional model fallback if GPT-4o still burned all tokens on reasoning
+                # (the fallback model is passed explicitly rather than swapped into
+                # self.model, so concurrent calls on the same participant stay isolated)
                 if allow_model_fallback:
                     for fb_model in fallback_models:
-                        prev_model = self.model
+                        # For non-reasoning models, we can include temperature.
+                        kwargs_fb = self._make_kwargs(
+                            messages=retry_messages,
+                            max_comp_tokens=max_tokens,  # smaller again; non-reasoning models typically emit faster
+                            temperature=temperature if fb_model not in self._NO_TEMPERATURE_MODELS else None,
+                            model=fb_model,
+                            # reasoning_effort="minimal",   # safe no-op for non-reasoning models
+                            verbosity=None,               # don't pass verbosity unless supported
+                            stream=stream,
+                        )
                         try:
-                            self.model = fb_model
-                            # For non-reasoning models, we can include temperature.
-                            kwargs_fb = self._make_kwargs(
-                                messages=retry_messages,
-                                max_comp_tokens=max_tokens,  # smaller again; non-reasoning models typically emit faster
-                                temperature=temperature if fb_model not in self._NO_TEMPERATURE_MODELS else None,
-                                # reasoning_effort="minimal",   # safe no-op for non-reasoning models
-                                verbosity=None,               # don't pass verbosity unless supported
-                            )
-                            resp_fb = self._call(kwargs_fb, network_attempts, request_timeout, debug, f"FALLBACK {fb_model}")
-                            content_fb, _, _ = extract(resp_fb)
-                            if content_fb:
-                                return content_fb
-                        finally:
-                            self.model = prev_model
+                            resp_fb = await self._acall(kwargs_fb, network_attempts, request_timeout, debug, f"FALLBACK {fb_model}", cache_bypass, hedge=hedge, stream_monitor=monitor)
+                        except CircuitOpenError:
+                            continue  # this fallback is degraded too; try the next one
+                        content_fb, _, _ = extract(resp_fb)
+                        if content_fb:
+                            return content_fb
 
                 # If we reach here, we got nothing useful back
                 raise RuntimeError(
@@ -173,9 +270,83 @@ class Participant:
             raise RuntimeError(
                 f"Empty completion from {self.model}. "
                 f"finish_reason={finish_reason}, reasoning_tokens={reasoning_used}, "
-                f"max_completion_tokens={max_tokens}"
+                f"max_completion_tokens={first_budget}"
             )
 
         except Exception as e:
             # Bubble up so the caller can decide to break/abort the run
             raise RuntimeError(f"Error calling {self.model} API: {e}") from e
+
+    @staticmethod
+    def _rejects_n(e: Exception) -> bool:
+        # 400 "Unsupported value/parameter: 'n' ..." from models that only return one choice
+        if getattr(e, "param", None) == "n":
+            return True
+        msg = str(e).lower()
+        return "'n'" in msg and ("support" in msg or "invalid" in msg)
+
+    def generate_outputs(self, user_instruction: str, num_outputs: int, **kwargs) -> List[str]:
+        """
+        Blocking wrapper around agenerate_outputs (same keyword arguments).
+        """
+        return run_sync(self.agenerate_outputs(user_instruction, num_outputs, **kwargs))
+
+    async def agenerate_outputs(
+        self,
+        user_instruction: Union[str, List[Dict[str, Any]]],
+        num_outputs: int,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        network_attempts: int = 6,
+        request_timeout: int = 90,
+        debug: bool = False,
+        cache_bypass: Optional[bool] = None,  # None = skip the response cache for sampled calls
+        **single_kwargs
+    ) -> List[str]:
+        """
+        Generates `num_outputs` candidates with one completion call (n=num_outputs), so the
+        prompt is sent and billed once instead of once per candidate.
+        Models that reject `n` are remembered and served by separate agenerate_output calls
+        with the usual "(Version #i)" suffix; choices that come back empty are topped up the
+        same way. single_kwargs go to those agenerate_output calls. No streaming in n mode.
+        The n call is a sampled call and skips the shared response cache unless
+        cache_bypass=False is passed.
+        """
+        async def single(i: int) -> str:
+            suffix = f"\n\n(Version #{i + 1})"
+            if isinstance(user_instruction, str):
+                instruction = user_instruction + suffix
+            else:
+                instruction = self._user_turns(user_instruction, suffix)
+            return await self.agenerate_output(
+                instruction,
+                temperature=temperature, max_tokens=max_tokens, network_attempts=network_attempts,
+                request_timeout=request_timeout, debug=debug, cache_bypass=cache_bypass, **single_kwargs
+            )
+
+        outputs = [""] * num_outputs
+        if num_outputs > 1 and self.model not in self._NO_N_MODELS:
+            kwargs = self._make_kwargs(
+                messages=[
+                    {"role": "system", "content": f"You are {self.name}. {self.persona_description}"},
+                    *self._user_turns(user_instruction),
+                ],
+                max_comp_tokens=max_tokens,
+                temperature=temperature,
+            )
+            kwargs["n"] = num_outputs
+            try:
+                resp = await self._acall(kwargs, network_attempts, request_timeout, debug, f"REQUEST n={num_outputs}",
+                                         cache_bypass is not False)
+                for choice in resp["choices"][:num_outputs]:
+                    outputs[choice.get("index", 0)] = ((choice.get("message") or {}).get("content") or "").strip()
+            except Exception as e:
+                if not self._rejects_n(e):
+                    raise RuntimeError(f"Error calling {self.model} API: {e}") from e
+                self._NO_N_MODELS.add(self.model)
+
+        # Separate requests for whatever the n call did not produce
+        missing = [i for i, out in enumerate(outputs) if not out]
+        for i, out in zip(missing, await asyncio.gather(*(single(i) for i in missing))):
+            outputs[i] = out
+        return outputs
@@ -0,0 +1,123 @@
+import time
+from typing import Optional
+
+from token_utils import estimate_tokens
+
+
+class RubricStreamMonitor:
+    """
+    Incremental rubric checks over a streamed completion.
+
+    Counts words (same rule as str.split) and must_include hits chunk by chunk, and asks
+    for the stream to be aborted once the answer exceeds the rubric's max word count
+    by more than `margin` (0.2 = 20%), since the evaluator would reject it anyway.
+    """
+
+    def __init__(self, rubric: dict, margin: float = 0.2):
+        self.max_words = rubric["word_count_range"][1]
+        self.abort_after = int(self.max_words * (1.0 + margin))
+        self.keywords = [kw.lower() for kw in rubric.get("must_include", [])]
+        self._overlap = max((len(kw) for kw in self.keywords), default=1) - 1
+        self.reset()
+
+    def reset(self):
+        """Called at the start of every (re)try of the stream."""
+        self.words = 0
+        self.found = set()
+        self._in_word = False
+        self._tail = ""
+
+    def feed(self, delta: str) -> bool:
+        """
+        Consumes the next piece of text; returns True when the stream should be aborted.
+        """
+        for ch in delta:
+            if ch.isspace():
+                self._in_word = False
+            elif not self._in_word:
+                self._in_word = True
+                self.words += 1
+
+        if len(self.found) < len(self.keywords):
+            # Keep a tail so keywords split across chunks are still found
+            window = self._tail + delta.lower()
+            for kw in self.keywords:
+                if kw not in self.found and kw in window:
+                    self.found.add(kw)
+            self._tail = window[-self._overlap:] if self._overlap else ""
+
+        return self.words > self.abort_after
+
+    @property
+    def missing(self):
+        return [kw for kw in self.keywords if kw not in self.found]
+
+    def stats(self) -> dict:
+        return {"words": self.words, "must_include_hits": len(self.found), "must_include_missing": self.missing}
+
+
+async def aconsume_stream(chunks, monitor: Optional[RubricStreamMonitor] = None, started: Optional[float] = None) -> dict:
+    """
+    Reads an openai 0.27 chat-completion stream into a regular (non-streamed) response dict,
+    so the rest of the call layer (cache, cassette, rate limiter, callers) is unchanged.
+    A monitor that returns True from feed() closes the stream early; the partial answer is
+    returned with finish_reason "aborted". The response carries "stream_stats" with
+    time-to-first-token and tokens/sec.
+    """
+    started = started if started is not None else time.monotonic()
+    if monitor is not None:
+        monitor.reset()
+    parts = []
+    finish_reason = None
+    usage = None
+    model = None
+    first_token_at = None
+    aborted = False
+    try:
+        async for chunk in chunks:
+            model = chunk.get("model") or model
+            if chunk.get("usage"):
+                usage = dict(chunk["usage"])
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content") or ""
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                parts.append(delta)
+                if monitor is not None and monitor.feed(delta):
+                    aborted = True
+                    break
+            if aborted:
+                break
+    finally:
+        if aborted and hasattr(chunks, "aclose"):
+            await chunks.aclose()  # drops the connection so the server stops generating
+
+    text = "".join(parts)
+    ended = time.monotonic()
+    completion_tokens = (usage or {}).get("completion_tokens") or estimate_tokens(text)
+    gen_sec = ended - first_token_at if first_token_at is not None else 0.0
+    stats = {
+        "ttft_sec": (first_token_at - started) if first_token_at is not None else None,
+        "tokens_per_sec": completion_tokens / gen_sec if gen_sec > 0 else None,
+        "completion_tokens": completion_tokens,
+        "aborted": aborted,
+    }
+    if monitor is not None:
+        stats.update(monitor.stats())
+    if usage is None:
+        usage = {"completion_tokens": completion_tokens}
+    return {
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "aborted" if aborted else finish_reason,
+        }],
+        "usage": usage,
+        "stream_stats": stats,
+    }
@@ -1,4 +1,15 @@
 
+from rubric import CompiledRubric
+
+# Known-good implementation the generated normalize_email tests are executed against
+NORMALIZE_EMAIL_REFERENCE = (
+    "def normalize_email(s: str) -> str:\n"
+    "    if \"@\" not in s:\n"
+    "        raise ValueError(f\"invalid email address: {s!r}\")\n"
+    "    return \" \".join(s.split()).lower()\n"
+)
+
+
 class Task:
     """
     Represents a single task with:
@@ -10,6 +21,14 @@ class Task:
         self.name = name
         self.target_spec = target_spec
         self.rubric = rubric
+        self._compiled_rubric = None
+
+    @property
+    def compiled_rubric(self) -> CompiledRubric:
+        """The rubric compiled once into a reusable matcher (see rubric.CompiledRubric)."""
+        if self._compiled_rubric is None:
+            self._compiled_rubric = CompiledRubric(self.rubric)
+        return self._compiled_rubric
 
     def __repr__(self):
         return f"Task(name={self.name}, target_spec={self.target_spec[:30]}...)"
@@ -39,6 +58,11 @@ def get_all_tasks():
             rubric={
                 "word_count_range": (120, 500),
                 "must_include": ["```python", "def test_", "assert", "ValueError", "pytest"],
+                # Mechanical rubric points (1, 2, 4, 5) checked locally with ast
+                "python_code": {"blocks": 1, "min_tests": 2, "min_asserts": 6, "min_raises": 1},
+                # Run the tests against a correct implementation (needs pytest_sandbox.configure_sandbox)
+                "execute_tests": {"reference_source": NORMALIZE_EMAIL_REFERENCE, "function": "normalize_email"},
+                "decisive_checks": True,
                 "evaluation_instructions": (
                     "1) Is a single Python code block present (```python ... ```)?\n"
                     "2) Are there multiple tests with names starting with test_?\n"
@@ -131,6 +155,9 @@ def get_all_tasks():
             rubric={
                 "word_count_range": (150, 500),
                 "must_include": ["feat(", "fix(", "docs(", "refactor(", "test(", "[JIRA-1234]"],
+                # Mechanical rubric points (1, 2, 5) checked locally
+                "commit_messages": {"count": 5, "ticket": "[JIRA-1234]", "max_subject_chars": 72},
+                "decisive_checks": True,
                 "evaluation_instructions": (
                     "1) Are there exactly 5 commit messages, one per line, in Conventional Commit style?\n"
                     "2) Do messages include a scope in parentheses and the ticket [JIRA-1234]?\n"
@@ -0,0 +1,146 @@
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+class RunTelemetry:
+    """
+    Per-run record of call-layer events (one simulate() of a participant/task pair).
+    The call layer appends to whichever RunTelemetry is active in the current context;
+    asyncio tasks spawned inside a run inherit it, so concurrent candidate calls are
+    attributed to the right row.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.circuit_events = []
+        self.reroutes = 0
+        self.hedged_requests = 0
+        self.llm_calls = 0
+        self.stream_stats = []
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        # Wall-clock time in which every call the run had outstanding was waiting for
+        # shared capacity (rate-limit budget, in-flight slots) rather than executing
+        self.queue_wait_sec = 0.0
+        self._waiting = 0
+        self._executing = 0
+        self._stalled_since = None
+
+    def add_circuit_event(self, model: str, event: str, **data):
+        self.circuit_events.append(
+            {"t": round(time.time() - self.started, 3), "model": model, "event": event, **data}
+        )
+
+    def add_usage(self, usage: dict):
+        """
+        Prompt tokens of one network call and how many of them the provider served from
+        its prompt cache (usage.prompt_tokens_details.cached_tokens).
+        """
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        details = usage.get("prompt_tokens_details") or {}
+        self.cached_prompt_tokens += details.get("cached_tokens") or 0
+
+    def _update_stall(self):
+        stalled = self._waiting > 0 and self._executing == 0
+        now = time.monotonic()
+        if stalled and self._stalled_since is None:
+            self._stalled_since = now
+        elif not stalled and self._stalled_since is not None:
+            self.queue_wait_sec += now - self._stalled_since
+            self._stalled_since = None
+
+    @contextmanager
+    def waiting(self):
+        """Around a wait for shared capacity (rate-limit budget, in-flight slot)."""
+        self._waiting += 1
+        self._update_stall()
+        try:
+            yield
+        finally:
+            self._waiting -= 1
+            self._update_stall()
+
+    @contextmanager
+    def executing(self):
+        """Around a request that holds its slot and is talking to the provider."""
+        self._executing += 1
+        self._update_stall()
+        try:
+            yield
+        finally:
+            self._executing -= 1
+            self._update_stall()
+
+    def add_stream_stats(self, stats: dict):
+        self.stream_stats.append(stats)
+
+    @staticmethod
+    def _mean(values):
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 4) if values else None
+
+    def to_row(self) -> dict:
+        """
+        Columns merged into the simulator result row. Always present (even when empty)
+        because append_dicts_to_csv fixes the header from the first row written.
+        """
+        return {
+            "circuit_events": json.dumps(self.circuit_events),
+            "circuit_reroutes": self.reroutes,
+            "hedged_requests": self.hedged_requests,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens_total": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "stream_calls": len(self.stream_stats),
+            "stream_aborts": sum(1 for s in self.stream_stats if s.get("aborted")),
+            "stream_ttft_sec": self._mean(s.get("ttft_sec") for s in self.stream_stats),
+            "stream_tokens_per_sec": self._mean(s.get("tokens_per_sec") for s in self.stream_stats),
+            "queue_wait_sec": round(self.queue_wait_sec, 4),
+        }
+
+    def merge_into(self, result: dict) -> dict:
+        """
+        Adds the to_row() columns to a simulator result row and takes the queue wait out
+        of its time_spent_sec, so that column measures the run's own work however many
+        other runs share the rate limits and in-flight caps.
+        """
+        result.update(self.to_row())
+        if result.get("time_spent_sec") is not None:
+            result["time_spent_sec"] = max(0.0, result["time_spent_sec"] - self.queue_wait_sec)
+        return result
+
+
+_current_run: ContextVar[Optional[RunTelemetry]] = ContextVar("pdr_run_telemetry", default=None)
+
+
+def current_run() -> Optional[RunTelemetry]:
+    return _current_run.get()
+
+
+@contextmanager
+def queue_wait():
+    """
+    RunTelemetry.waiting() of the active run (no-op outside a run).
+    """
+    run = current_run()
+    if run is None:
+        yield
+        return
+    with run.waiting():
+        yield
+
+
+@contextmanager
+def track_run():
+    """
+    Activates a fresh RunTelemetry for the duration of one simulation run.
+    """
+    telemetry = RunTelemetry()
+    token = _current_run.set(telemetry)
+    try:
+        yield telemetry
+    finally:
+        _current_run.reset(token)
@@ -0,0 +1,41 @@
+import os
+import sys
+import types
+
+# The modules live flat in pdr-gpt5/ and import each other by bare name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _openai_stub():
+    # Just enough of openai 0.27 for the call layer; tests patch ChatCompletion.acreate
+    openai = types.ModuleType("openai")
+    error = types.ModuleType("openai.error")
+
+    class OpenAIError(Exception):
+        def __init__(self, message="", http_status=None, headers=None, param=None):
+            super().__init__(message)
+            self.http_status = http_status
+            self.headers = headers or {}
+            self.param = param
+
+    for name in ("APIError", "RateLimitError", "InvalidRequestError", "Timeout", "APIConnectionError",
+                 "ServiceUnavailableError", "TryAgain"):
+        setattr(error, name, type(name, (OpenAIError,), {}))
+    error.OpenAIError = OpenAIError
+
+    class ChatCompletion:
+        @staticmethod
+        async def acreate(**kwargs):
+            raise AssertionError("tests must patch openai.ChatCompletion.acreate")
+
+    import contextvars
+    openai.error = error
+    openai.ChatCompletion = ChatCompletion
+    openai.aiosession = contextvars.ContextVar("aiohttp-session", default=None)
+    return openai, error
+
+
+try:
+    import openai  # noqa: F401
+except ImportError:
+    sys.modules["openai"], sys.modules["openai.error"] = _openai_stub()
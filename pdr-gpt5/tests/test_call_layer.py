@@ -0,0 +1,91 @@
+import asyncio
+
+import openai
+import pytest
+from openai import error as oe
+
+from circuit_breaker import CircuitOpenError, configure_circuit_breakers, get_breaker
+from response_cache import ResponseCache, set_response_cache
+from retry_helpers import achat_with_retries, chat_with_retries
+
+FAST = {"base": 0.001, "cap": 0.001, "jitter": 0.0}
+REQUEST = {"model": "gpt-test", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def reply(text="ok"):
+    return {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": {"prompt_tokens": 3}}
+
+
+@pytest.fixture
+def acreate(monkeypatch):
+    """Scripted openai.ChatCompletion.acreate: each call pops the next outcome."""
+    outcomes, calls = [], []
+
+    async def fake(**kwargs):
+        calls.append(kwargs)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", fake)
+    fake.outcomes, fake.calls = outcomes, calls
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def _reset_call_layer():
+    yield
+    configure_circuit_breakers(enabled=False)
+    set_response_cache(None)
+
+
+def test_retryable_errors_are_retried(acreate):
+    acreate.outcomes += [oe.RateLimitError("slow down", http_status=429), oe.APIError("bad gateway", http_status=502),
+                         reply()]
+    resp = asyncio.run(achat_with_retries(**FAST, **REQUEST))
+    assert resp["choices"][0]["message"]["content"] == "ok"
+    assert len(acreate.calls) == 3
+
+
+def test_non_retryable_error_is_raised_at_once(acreate):
+    acreate.outcomes.append(oe.InvalidRequestError("bad param", http_status=400))
+    with pytest.raises(oe.InvalidRequestError):
+        asyncio.run(achat_with_retries(**FAST, **REQUEST))
+    assert len(acreate.calls) == 1
+
+
+def test_sync_wrapper_runs_the_async_path(acreate):
+    acreate.outcomes += [oe.RateLimitError("slow down", http_status=429), reply("sync")]
+    assert chat_with_retries(**FAST, **REQUEST)["choices"][0]["message"]["content"] == "sync"
+    assert len(acreate.calls) == 2
+
+
+def test_response_cache_serves_repeats(acreate, tmp_path):
+    set_response_cache(ResponseCache(str(tmp_path / "responses.sqlite")))
+    acreate.outcomes.append(reply("cached"))
+    first = asyncio.run(achat_with_retries(**FAST, **REQUEST))
+    second = asyncio.run(achat_with_retries(**FAST, **REQUEST))
+    assert first == second
+    assert len(acreate.calls) == 1
+
+
+def test_open_circuit_short_circuits_the_backoff_ladder(acreate):
+    configure_circuit_breakers(failure_threshold=2, recovery_sec=60.0)
+    acreate.outcomes += [oe.APIError("down", http_status=503)] * 2
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(achat_with_retries(max_attempts=6, **FAST, **REQUEST))
+    assert len(acreate.calls) == 2
+    assert get_breaker("gpt-test").stats()["state"] == "open"
+
+
+def test_half_open_probe_is_released_after_a_non_retryable_error(acreate):
+    configure_circuit_breakers(failure_threshold=1, recovery_sec=0.0)
+    breaker = get_breaker("gpt-test")
+    breaker.record_failure()  # open; recovery_sec=0 lets the next call probe
+    acreate.outcomes += [oe.InvalidRequestError("bad param", http_status=400), reply()]
+    with pytest.raises(oe.InvalidRequestError):
+        asyncio.run(achat_with_retries(**FAST, **REQUEST))
+    # The probe slot was handed back, so the next caller may probe and close the circuit
+    asyncio.run(achat_with_retries(**FAST, **REQUEST))
+    assert breaker.stats()["state"] == "closed"
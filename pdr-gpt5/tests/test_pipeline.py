@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_records_flow_through_stages_and_join_in_order():
+    async def double(record):
+        await asyncio.sleep(0.01 * (5 - record["input"]))  # later items finish first
+        return record["input"] * 2
+
+    async def total(records):
+        return [r["double"] for r in records]
+
+    out = run(Pipeline([Stage("double", double, workers=None), Stage("total", total, join=True)]).run(range(5)))
+    assert out["total"] == [0, 2, 4, 6, 8]
+    assert [r["index"] for r in out["items"]] == list(range(5))
+    assert out["stopped_by"] is None
+
+
+def test_workers_bound_concurrency_per_stage():
+    active = {"now": 0, "peak": 0}
+
+    async def step(record):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+
+    run(Pipeline([Stage("step", step, workers=2)]).run(range(8)))
+    assert active["peak"] == 2
+
+
+def test_stop_when_cancels_in_flight_work_and_skips_join():
+    cancelled, joined = [], []
+
+    async def generate(record):
+        try:
+            await asyncio.sleep(0.01 if record["input"] == 1 else 1.0)
+        except asyncio.CancelledError:
+            cancelled.append(record["index"])
+            raise
+        return record["input"]
+
+    async def review(records):
+        joined.append(records)
+
+    pipeline = Pipeline([Stage("generate", generate, workers=None), Stage("review", review, join=True)],
+                        stop_when=lambda record: record["generate"] == 1)
+    out = run(asyncio.wait_for(pipeline.run(range(4)), timeout=0.5))
+    assert out["stopped_by"]["index"] == 1
+    assert sorted(cancelled) == [0, 2, 3]
+    assert joined == [] and "review" not in out
+    assert [r["index"] for r in out["items"]] == [1]
+
+
+def test_stage_failure_cancels_the_rest_and_propagates():
+    cancelled = []
+
+    async def step(record):
+        if record["input"] == 0:
+            raise ValueError("boom")
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            cancelled.append(record["index"])
+            raise
+
+    with pytest.raises(ValueError, match="boom"):
+        run(Pipeline([Stage("step", step, workers=None)]).run(range(3)))
+    assert sorted(cancelled) == [1, 2]
+
+
+def test_cancelling_the_caller_cancels_every_stage_task():
+    started, cancelled = [], []
+
+    async def step(record):
+        started.append(record["index"])
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(record["index"])
+            raise
+
+    async def main():
+        task = asyncio.ensure_future(Pipeline([Stage("step", step, workers=None)]).run(range(3)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        leftovers = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        return leftovers
+
+    assert run(main()) == []
+    assert sorted(started) == sorted(cancelled) == [0, 1, 2]
+
+
+def test_join_stage_must_be_last():
+    async def noop(_):
+        return None
+
+    with pytest.raises(ValueError):
+        Pipeline([Stage("j", noop, join=True), Stage("s", noop)])
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from pytest_sandbox import PytestSandbox, rewrite_imports
+
+REFERENCE = "def f(x):\n    return x\n"
+PASSING = "from m import f\n\ndef test_identity():\n    assert f(1) == 1\n"
+SLOW = "import time\nfrom m import f\n\ndef test_slow():\n    time.sleep(0.3)\n    assert f(1) == 1\n"
+# Ignores SIGALRM, so only the parent's hang deadline can end it
+HANG = ("import signal, time\nfrom m import f\n\ndef test_hang():\n"
+        "    signal.signal(signal.SIGALRM, signal.SIG_IGN)\n    time.sleep(100)\n")
+
+
+@pytest.fixture
+def sandbox_factory():
+    created = []
+
+    def make(**kwargs):
+        sandbox = PytestSandbox(cpu_sec=None, **kwargs)
+        sandbox.warm()
+        created.append(sandbox)
+        return sandbox
+
+    yield make
+    for sandbox in created:
+        sandbox.close()
+
+
+def test_rewrite_imports_targets_the_reference_module():
+    rewritten = rewrite_imports("from solution import f\n\ndef test_a():\n    assert f(1) == 1\n", "f")
+    assert "from reference_impl import f" in rewritten
+    assert "solution" not in rewritten
+    assert rewrite_imports("def broken(:\n", "f") is None
+
+
+def test_passing_and_failing_counts(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout_sec=5.0)
+    failing = "from m import f\n\ndef test_a():\n    assert f(1) == 1\n\ndef test_b():\n    assert f(1) == 2\n"
+    result = asyncio.run(sandbox.arun_tests(failing, REFERENCE, "f"))
+    assert (result["collected"], result["passed"], result["failed"]) == (2, 1, 1)
+    assert result["limit_hit"] is None
+
+
+def test_oversubscription_does_not_count_queue_time_as_timeout(sandbox_factory):
+    # 12 runs of ~0.3s through one worker take ~4s in total, well past the 1s timeout,
+    # but each run's clock only starts once it holds the worker
+    sandbox = sandbox_factory(workers=1, timeout_sec=1.0)
+
+    async def main():
+        return await asyncio.gather(*(sandbox.arun_tests(SLOW, REFERENCE, "f") for _ in range(12)))
+
+    results = asyncio.run(main())
+    assert [r["limit_hit"] for r in results] == [None] * 12
+    assert all(r["passed"] == 1 for r in results)
+    assert sandbox.stats()["timeouts"] == 0
+
+
+def test_hung_run_is_the_only_one_charged(sandbox_factory):
+    sandbox = sandbox_factory(workers=2, timeout_sec=0.5)
+
+    async def main():
+        return await asyncio.gather(sandbox.arun_tests(HANG, REFERENCE, "f"),
+                                    *(sandbox.arun_tests(SLOW, REFERENCE, "f") for _ in range(6)))
+
+    hung, *others = asyncio.run(main())
+    assert hung["limit_hit"] == "timeout"
+    assert [r["limit_hit"] for r in others] == [None] * 6
+    assert sandbox.stats()["timeouts"] == 1
+
+
+def test_caller_cancellation_propagates(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout_sec=5.0)
+
+    async def main():
+        task = asyncio.ensure_future(sandbox.arun_tests(SLOW, REFERENCE, "f"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
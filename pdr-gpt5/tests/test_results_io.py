@@ -0,0 +1,44 @@
+from results_io import append_dicts_to_csv, load_complete_rows
+
+
+def test_missing_or_empty_file_loads_nothing(tmp_path):
+    path = tmp_path / "results.csv"
+    assert load_complete_rows(str(path)) == []
+    path.write_text("")
+    assert load_complete_rows(str(path)) == []
+
+
+def test_complete_file_is_returned_untouched(tmp_path):
+    path = str(tmp_path / "results.csv")
+    append_dicts_to_csv([{"a": 1, "b": "x"}, {"a": 2, "b": "multi\nline"}], path)
+    before = open(path, "rb").read()
+    assert load_complete_rows(path) == [{"a": "1", "b": "x"}, {"a": "2", "b": "multi\nline"}]
+    assert open(path, "rb").read() == before
+
+
+def test_truncated_tail_is_dropped_and_file_repaired(tmp_path):
+    path = str(tmp_path / "results.csv")
+    append_dicts_to_csv([{"a": 1, "b": "x"}, {"a": 2, "b": "y"}], path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("3,half-writ")  # crash mid-row: no line terminator
+
+    assert load_complete_rows(path) == [{"a": "1", "b": "x"}, {"a": "2", "b": "y"}]
+    # Appends after the repair start on a clean line
+    append_dicts_to_csv([{"a": 3, "b": "z"}], path)
+    assert [r["a"] for r in load_complete_rows(path)] == ["1", "2", "3"]
+
+
+def test_truncated_tail_inside_quoted_cell(tmp_path):
+    path = str(tmp_path / "results.csv")
+    append_dicts_to_csv([{"a": 1, "b": "x"}], path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('2,"open quote\nstill going')
+
+    assert load_complete_rows(path) == [{"a": "1", "b": "x"}]
+
+
+def test_rows_with_missing_cells_are_skipped(tmp_path):
+    path = tmp_path / "results.csv"
+    path.write_bytes(b"a,b,c\r\n1,2,3\r\n4,5\r\n6,7,8\r\n")
+    assert load_complete_rows(str(path)) == [{"a": "1", "b": "2", "c": "3"}, {"a": "6", "b": "7", "c": "8"}]
+    assert path.read_bytes() == b"a,b,c\r\n1,2,3\r\n6,7,8\r\n"
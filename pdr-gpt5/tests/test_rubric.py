@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from rubric import CompiledRubric, KeywordAutomaton
+from tasks import get_all_tasks
+
+
+def legacy_score(text, rubric):
+    # The Evaluator's original keyword check and scoring
+    min_count, max_count = rubric["word_count_range"]
+    word_count_ok = min_count <= len(text.split()) <= max_count
+    keywords_ok = all(kw.lower() in text.lower() for kw in rubric.get("must_include", []))
+    return {"word_count_ok": word_count_ok, "must_include_ok": keywords_ok,
+            "score": 50 + 25 * word_count_ok + 25 * keywords_ok}
+
+
+def keyword_only(rubric):
+    return {key: rubric[key] for key in ("word_count_range", "must_include") if key in rubric}
+
+
+def random_text(rng, vocabulary, words):
+    return rng.choice(["", " ", "\n"]).join(rng.choice(vocabulary) for _ in range(words))
+
+
+@pytest.mark.parametrize("task", get_all_tasks(), ids=lambda t: t.name)
+def test_scores_match_legacy_keyword_check(task):
+    rubric = keyword_only(task.rubric)
+    compiled = CompiledRubric(rubric)
+    vocabulary = [kw for kw in rubric["must_include"]] + ["lorem", "IPSUM", "\t", "x" * 40, "Dolor\n"]
+    rng = random.Random(task.name)
+    low, high = rubric["word_count_range"]
+    for words in [0, low - 1, low, (low + high) // 2, high, high + 1]:
+        for _ in range(5):
+            text = random_text(rng, vocabulary, max(0, words))
+            expected = legacy_score(text, rubric)
+            result = compiled.check(text)
+            assert {k: result[k] for k in expected} == expected
+            assert result["word_count"] == len(text.split())
+
+
+def test_automaton_finds_overlapping_and_case_insensitive_keywords():
+    automaton = KeywordAutomaton(["he", "She", "hers", "his", "ers", "```python"])
+    found = {automaton.keywords[i] for i in automaton.find("uSHErs and ```Python")}
+    assert found == {"he", "she", "hers", "ers", "```python"}
+    assert automaton.find("nothing here?") == {automaton.keywords.index("he")}
+
+
+def test_automaton_matches_substring_search_on_random_input():
+    rng = random.Random(0)
+    for _ in range(200):
+        keywords = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(6)]
+        text = "".join(rng.choice("abcABC ") for _ in range(rng.randint(0, 30)))
+        automaton = KeywordAutomaton(keywords)
+        found = {automaton.keywords[i] for i in automaton.find(text)}
+        assert found == {kw.lower() for kw in keywords if kw.lower() in text.lower()}
+
+
+def test_missing_keywords_keep_rubric_order():
+    compiled = CompiledRubric({"word_count_range": (0, 10), "must_include": ["b", "A", "zz"]})
+    assert compiled.missing_keywords("a only") == ["b", "zz"]
+
+
+def test_decisive_only_with_decisive_checks():
+    rubric = {"word_count_range": (1, 100), "must_include": [], "regex": r"^done$"}
+    assert CompiledRubric(rubric).check("nope")["decisive"] is False
+
+    compiled = CompiledRubric({**rubric, "decisive_checks": True})
+    failed = compiled.check("nope")
+    assert failed["decisive"] and failed["score"] == 75
+    assert failed["check_failures"] == ["regex check failed"]
+    passed = compiled.check("done")
+    assert passed["decisive"] and passed["score"] == 100
+
+    # Passing checks but missing keywords: the LLM analysis still has a say
+    partial = CompiledRubric({**rubric, "must_include": ["extra"], "decisive_checks": True}).check("done")
+    assert partial["checks_ok"] and not partial["decisive"]
+
+
+def test_add_check_rescores():
+    compiled = CompiledRubric({"word_count_range": (1, 100), "regex": "ok", "decisive_checks": True})
+    results = compiled.check("ok")
+    assert results["score"] == 100
+    compiled.add_check(results, "tests_pass", False, ["1 of 2 tests fail"])
+    assert results["score"] == 75 and results["decisive"]
+    assert results["check_failures"] == ["1 of 2 tests fail"]
@@ -0,0 +1,37 @@
+import math
+from typing import Any, Dict
+
+# Optional: exact token counts when tiktoken is installed
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # Fall back to the ~4 characters/token rule of thumb
+    _ENCODING = None
+
+# Per-message framing overhead of the chat format
+_TOKENS_PER_MESSAGE = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Token count of `text` (exact with tiktoken, otherwise ~len/4).
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return int(math.ceil(len(text) / 4.0))
+
+
+def estimate_prompt_tokens(messages) -> int:
+    return sum(_TOKENS_PER_MESSAGE + estimate_tokens(m.get("content") or "") for m in messages or [])
+
+
+def estimate_request_tokens(kwargs: Dict[str, Any]) -> int:
+    """
+    Upper-bound token cost of a chat-completion request before it is sent:
+    prompt tokens + the completion budget (max_tokens / max_completion_tokens) for each of n choices.
+    """
+    completion = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0
+    return estimate_prompt_tokens(kwargs.get("messages")) + int(completion) * int(kwargs.get("n") or 1)